@@ -0,0 +1,47 @@
+from array import array
+
+OPTION_KEYS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class Answer:
+    """One submitted answer; question and option text are looked up in the quiz, not copied"""
+
+    __slots__ = ("question_index", "selected_key", "is_correct")
+
+    def __init__(self, question_index, selected_key, is_correct):
+        self.question_index = question_index
+        self.selected_key = selected_key
+        self.is_correct = is_correct
+
+
+class AnswerLog:
+    """A session's answers as three parallel arrays: a few bytes per answer.
+
+    Question text, options and explanations already live in the quiz's question
+    list, so each answer only records which question it was, the chosen option
+    letter and whether it was right.
+    """
+
+    __slots__ = ("_questions", "_selected", "_correct")
+
+    def __init__(self):
+        self._questions = array("H")
+        self._selected = array("B")
+        self._correct = array("B")
+
+    def append(self, question_index, selected_key, is_correct):
+        self._questions.append(question_index)
+        self._selected.append(OPTION_KEYS.index(selected_key))
+        self._correct.append(bool(is_correct))
+
+    def __len__(self):
+        return len(self._questions)
+
+    def __getitem__(self, i):
+        return Answer(self._questions[i], OPTION_KEYS[self._selected[i]], bool(self._correct[i]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def correct_count(self):
+        return sum(self._correct)
@@ -1,14 +1,30 @@
 import streamlit as st
-import PyPDF2
+from streamlit.errors import StreamlitAPIException
 import json
-from io import BytesIO
-import google.generativeai as genai
 import os
+import hashlib
+import threading
 import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from answer_log import AnswerLog
+from caching import GenerationCache, LRUCache, TextStore, make_cache_key
+from json_parsing import repair_stats
+from metrics import metrics
+from question_pipeline import generate_balanced, generate_validated, split_counts, stream_validated
+from llm_backends import create_backend
+from rate_limiter import RateLimiter, RateLimitError, estimate_tokens
+from layout_cleanup import LayoutCleaner
+from question_bank import QuestionBank
+from prefetch import Prefetcher
+from single_flight import SingleFlight, SingleFlightTimeout
+from paged_quiz import PagedQuiz, difficulty_results
 
 # MUST BE FIRST COMMAND
 st.set_page_config(page_title="AI Quiz Generator", layout="wide")
+run_started = time.perf_counter()
 
 # Initialize session state
 if 'questions' not in st.session_state:
@@ -18,15 +34,19 @@ if 'current_question' not in st.session_state:
 if 'score' not in st.session_state:
     st.session_state.score = 0
 if 'user_answers' not in st.session_state:
-    st.session_state.user_answers = []
+    st.session_state.user_answers = AnswerLog()
 if 'quiz_complete' not in st.session_state:
     st.session_state.quiz_complete = False
-if 'text_content' not in st.session_state:
-    st.session_state.text_content = ""
+if 'text_hash' not in st.session_state:
+    st.session_state.text_hash = None  # Key of the current document in the shared text store
 if 'language' not in st.session_state:
     st.session_state.language = "en"  # Default to English
-if 'last_api_call' not in st.session_state:
-    st.session_state.last_api_call = 0
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # Identifies this session to the shared rate limiter
+if 'question_stream' not in st.session_state:
+    st.session_state.question_stream = None
+if 'cleanup_stats' not in st.session_state:
+    st.session_state.cleanup_stats = {}  # File digest -> LayoutCleaner.stats()
 
 # RTL CSS for Arabic
 RTL_CSS = """
@@ -91,11 +111,18 @@ translations = {
         "your_answer": "**Your Answer:**",
         "correct_answer": "**Correct Answer:**",
         "api_wait": "Please wait {seconds} seconds before generating more questions",
+        "offline_unavailable": "The AI model is unavailable, so these questions were built directly from your text",
+        "offline_failed": "The AI model could not generate questions, so these were built directly from your text",
+        "offline_busy": "The AI model is busy for about {seconds} seconds, so these questions were built directly from your text. The AI quiz is still being prepared for your next quiz",
+        "short_quiz": "Only {delivered} of {requested} questions could be generated",
+        "coalesce_timeout": "The same quiz is already being generated for someone else and is taking too long. Please try again.",
         "processing_file": "Processing file...",
         "api_error": "API Error: Please check your API key and try again",
         "loading_model": "Loading AI model...",
         "invalid_question": "Skipped invalid question format",
-        "question_error": "Error displaying question: {error}"
+        "question_error": "Error displaying question: {error}",
+        "layout_cleanup_saved": "Removed {chars:,} characters (~{tokens:,} tokens) of headers, footers and layout noise",
+        "drawn_from_bank": "Quiz drawn from {count} saved questions for this document, without calling the API"
     },
     "ar": {
         "title": "🧠 منشئ الأسئلة بالذكاء الاصطناعي",
@@ -127,174 +154,542 @@ translations = {
         "your_answer": "**إجابتك:**",
         "correct_answer": "**الإجابة الصحيحة:**",
         "api_wait": "الرجاء الانتظار {seconds} ثانية قبل إنشاء المزيد من الأسئلة",
+        "offline_unavailable": "نموذج الذكاء الاصطناعي غير متاح، لذلك تم بناء هذه الأسئلة مباشرة من النص",
+        "offline_failed": "تعذر على نموذج الذكاء الاصطناعي إنشاء الأسئلة، لذلك تم بناؤها مباشرة من النص",
+        "offline_busy": "نموذج الذكاء الاصطناعي مشغول لمدة {seconds} ثانية تقريبًا، لذلك تم بناء هذه الأسئلة مباشرة من النص. لا يزال اختبار الذكاء الاصطناعي قيد التحضير لاختبارك التالي",
+        "short_quiz": "تم إنشاء {delivered} فقط من أصل {requested} سؤال",
+        "coalesce_timeout": "يتم بالفعل إنشاء نفس الاختبار لمستخدم آخر ويستغرق وقتًا طويلاً. يرجى المحاولة مرة أخرى.",
         "processing_file": "جارٍ معالجة الملف...",
         "api_error": "خطأ في الواجهة البرمجية: يرجى التحقق من مفتاح API والمحاولة مرة أخرى",
         "loading_model": "جارٍ تحميل نموذج الذكاء الاصطناعي...",
         "invalid_question": "تم تخطي سؤال غير صحيح",
-        "question_error": "خطأ في عرض السؤال: {error}"
+        "question_error": "خطأ في عرض السؤال: {error}",
+        "layout_cleanup_saved": "تمت إزالة {chars:,} حرفًا (~{tokens:,} رمزًا) من الترويسات والتذييلات والمسافات الزائدة",
+        "drawn_from_bank": "تم سحب الاختبار من {count} سؤالًا محفوظًا لهذا المستند دون استدعاء الواجهة البرمجية"
     }
 }
 
-# Configure Gemini API with caching
+LLM_BACKEND = os.environ.get("QUIZ_LLM_BACKEND", "gemini")  # gemini, openai or fake
+MODEL_NAME = os.environ.get("QUIZ_MODEL_NAME", 'gemini-1.5-flash')
+PROMPT_VERSION = 3  # Bump whenever the prompt text changes so stale cache entries are ignored
+CACHE_DIR = os.environ.get("QUIZ_CACHE_DIR", ".quiz_cache")
+PDF_WORKERS = int(os.environ.get("QUIZ_PDF_WORKERS", min(4, os.cpu_count() or 1)))  # Shared by all uploads
+EXTRACTION_CACHE_ENTRIES = 32
+REQUESTS_PER_MINUTE = int(os.environ.get("QUIZ_REQUESTS_PER_MINUTE", 15))
+TOKENS_PER_MINUTE = int(os.environ.get("QUIZ_TOKENS_PER_MINUTE", 1_000_000))
+EXTRACTION_CACHE_CHARS = int(os.environ.get("QUIZ_EXTRACTION_CACHE_CHARS", 50_000_000))  # Shared text store cap
+BANK_PATH = os.environ.get("QUIZ_BANK_PATH", "question_bank.sqlite3")
+PREFETCH_MAX_BYTES = int(os.environ.get("QUIZ_PREFETCH_MAX_BYTES", 5_000_000))  # Prefetched quizzes across sessions
+PREFETCH_WAIT_SECONDS = 120  # How long "Start New Quiz" waits for a prefetch that is still running
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("QUIZ_CONTEXT_TOKENS", 6000))  # Document tokens sent per generation
+OFFLINE_AFTER_SECONDS = int(os.environ.get("QUIZ_OFFLINE_AFTER_SECONDS", 20))  # Longer API waits get offline questions
+COALESCE_WAIT_SECONDS = int(os.environ.get("QUIZ_COALESCE_WAIT_SECONDS", 300))  # Wait on an identical in-flight generation
+METRICS_PATH = os.environ.get("QUIZ_METRICS_PATH", "")  # .prom for Prometheus text, anything else for JSON
+METRICS_WRITE_SECONDS = 10  # Minimum time between metrics file writes
+
+# Configure the LLM backend with caching
 @st.cache_resource(show_spinner=False)
-def configure_google_api():
+def configure_backend():
     t = translations[st.session_state.language]
     with st.spinner(t["loading_model"]):
-        if "GOOGLE_API_KEY" in os.environ:
-            genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-        elif "GOOGLE_API_KEY" in st.secrets:
-            genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-        else:
-            st.error(t["api_error"])
-            return None
-        
         try:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            return model
+            if LLM_BACKEND == "fake":
+                return create_backend("fake")
+            if LLM_BACKEND == "openai":
+                return create_backend("openai", model_name=MODEL_NAME)
+            if "GOOGLE_API_KEY" in os.environ:
+                api_key = os.environ["GOOGLE_API_KEY"]
+            elif "GOOGLE_API_KEY" in st.secrets:
+                api_key = st.secrets["GOOGLE_API_KEY"]
+            else:
+                st.error(t["api_error"])
+                return None
+            return create_backend("gemini", api_key=api_key, model_name=MODEL_NAME)
         except Exception as e:
             st.error(f"{t['api_error']}: {str(e)}")
             return None
 
-model = configure_google_api()
+backend = configure_backend()
 
-def validate_question(question):
-    """Validate the structure of a question and fix common issues"""
-    if not isinstance(question, dict):
-        return None
-        
-    required_keys = ['question', 'options', 'correct', 'difficulty', 'explanation']
-    if not all(key in question for key in required_keys):
-        return None
-    
-    # Ensure we have at least 2 options
-    if not isinstance(question['options'], list) or len(question['options']) < 2:
+# Shared across sessions so every user benefits from previously generated quizzes
+@st.cache_resource(show_spinner=False)
+def get_generation_cache():
+    return GenerationCache(CACHE_DIR)
+
+# One limiter for the whole process so sessions share the API budget fairly
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter():
+    return RateLimiter(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE)
+
+rate_limiter = get_rate_limiter()
+
+# Every validated question is banked so later quizzes on the same document can skip the API
+@st.cache_resource(show_spinner=False)
+def get_question_bank():
+    return QuestionBank(BANK_PATH)
+
+question_bank = get_question_bank()
+
+# Next quizzes prepared in the background, shared by all sessions under one memory cap
+@st.cache_resource(show_spinner=False)
+def get_prefetcher():
+    return Prefetcher(max_bytes=PREFETCH_MAX_BYTES)
+
+prefetcher = get_prefetcher()
+
+# Identical generations requested at the same time (a class opening the same handout) share one model call
+@st.cache_resource(show_spinner=False)
+def get_single_flight():
+    return SingleFlight()
+
+single_flight = get_single_flight()
+
+# Every session's document, held once per process however many sessions use it; sessions keep only its hash
+@st.cache_resource(show_spinner=False)
+def get_text_store():
+    return TextStore(max_chars=EXTRACTION_CACHE_CHARS)
+
+text_store = get_text_store()
+
+# The current document's text, or "" if there is none or it has been evicted from the store
+def current_text():
+    return text_store.get(st.session_state.text_hash) or ""
+
+# Components that keep their own counters are read when metrics are exported
+@st.cache_resource(show_spinner=False)
+def register_metric_collectors():
+    metrics.add_collector("rate_limiter", rate_limiter.metrics)
+    metrics.add_collector("json_repair", repair_stats.snapshot)
+    metrics.add_collector("generation_cache", get_generation_cache().stats)
+    metrics.add_collector("prefetch", prefetcher.stats)
+    metrics.add_collector("question_bank", question_bank.stats)
+    metrics.add_collector("single_flight", single_flight.stats)
+    metrics.add_collector("text_store", text_store.stats)
+    return True
+
+register_metric_collectors()
+
+# Text store key of each upload's extracted text, by file content, so reruns never re-parse the same upload
+@st.cache_resource(show_spinner=False)
+def get_extraction_cache():
+    return LRUCache(max_entries=EXTRACTION_CACHE_ENTRIES)
+
+# One pool of PDF extraction processes for the whole server, so concurrent uploads queue for the same
+# PDF_WORKERS processes instead of each starting their own; None extracts in the session's own thread.
+# Workers come from a fork server, since forking the multi-threaded Streamlit server itself is unsafe
+@st.cache_resource(show_spinner=False)
+def get_pdf_pool():
+    if PDF_WORKERS <= 1:
         return None
-    
-    # Ensure correct answer is one of the options
-    if question['correct'] not in ['A', 'B', 'C', 'D']:
-        # Try to find the correct answer in options
-        for i, option in enumerate(question['options']):
-            if option == question['correct']:
-                question['correct'] = chr(65 + i)  # Convert to A, B, C, D
-                break
-        else:
-            # If we can't match, default to first option
-            question['correct'] = 'A'
-    
-    return question
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
 
-# Extract text from file with progress
+# Extract text from file with progress; returns (text, key in the shared text store), or ("", None) on failure.
+# The text is returned as well so this run never depends on reading it back from the store
 def extract_text_from_file(uploaded_file):
     t = translations[st.session_state.language]
     if uploaded_file is None:
-        return ""
-    
+        return "", None
+
+    cache = get_extraction_cache()
+    file_digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    cache_key = make_cache_key(uploaded_file.type, file_digest)
+    text_hash = cache.get(cache_key)
+    text = text_store.get(text_hash)
+    metrics.increment("extraction_cache", result="hit" if text is not None else "miss")
+    if text is not None:
+        show_cleanup_stats(file_digest)
+        return text, text_hash
+
+    started = time.perf_counter()
     progress_bar = st.progress(0, text=t["processing_file"])
     try:
         if uploaded_file.type == "application/pdf":
-            pdf_reader = PyPDF2.PdfReader(BytesIO(uploaded_file.read()))
-            text = ""
-            total_pages = len(pdf_reader.pages)
-            for i, page in enumerate(pdf_reader.pages):
-                text += page.extract_text() + "\n"
-                progress_bar.progress((i + 1) / total_pages)
-            return text
+            # UploadedFile is already an in-memory buffer, so PyPDF2 can read it directly
+            from text_processor import extract_text_from_pdf  # PyPDF2 loads on the first PDF, not at start-up
+            cleaner = LayoutCleaner()
+            text = extract_text_from_pdf(
+                uploaded_file,
+                separator="\n",
+                progress=lambda done, total: progress_bar.progress(done / total),
+                cleaner=cleaner,
+                executor=get_pdf_pool()
+            )
+            st.session_state.cleanup_stats[file_digest] = cleaner.stats()
         elif uploaded_file.type == "text/plain":
-            return uploaded_file.read().decode("utf-8")
+            text = uploaded_file.getvalue().decode("utf-8")
         else:
             st.error("Unsupported file type. Please upload a PDF or text file.")
-            return ""
+            return "", None
     except Exception as e:
         st.error(f"Error reading file: {str(e)}")
-        return ""
+        return "", None
     finally:
         progress_bar.empty()
+    metrics.observe("extraction_seconds", time.perf_counter() - started, type=uploaded_file.type)
+    metrics.observe("extracted_chars", len(text))
+
+    text_hash = text_store.put(text)
+    cache.set(cache_key, text_hash)
+    show_cleanup_stats(file_digest)
+    return text, text_hash
+
+# Show what layout cleanup saved when this session extracted the file
+def show_cleanup_stats(file_digest):
+    t = translations[st.session_state.language]
+    stats = st.session_state.cleanup_stats.get(file_digest)
+    if stats and stats["chars_saved"]:
+        st.caption(t["layout_cleanup_saved"].format(chars=stats["chars_saved"], tokens=stats["tokens_saved"]))
+
+# doc_hash is the session's text_hash, so building a key never rehashes the document
+def generation_cache_key(doc_hash, total_questions, num_easy, num_mid, num_hard, language, balanced=False):
+    # Balanced results are keyed apart so a short single-call quiz is never served in their place
+    return make_cache_key(
+        doc_hash, total_questions, num_easy, num_mid, num_hard,
+        language, LLM_BACKEND, MODEL_NAME, PROMPT_VERSION, CONTEXT_TOKEN_BUDGET,
+        *(["balanced"] if balanced else [])
+    )
+
+# Let the user know when the shared rate limiter will queue their request
+def warn_if_rate_limited():
+    t = translations[st.session_state.language]
+    wait_time = int(rate_limiter.estimated_wait())
+    if wait_time > 0:
+        st.warning(t["api_wait"].format(seconds=wait_time))
+
+# Call the backend through the shared rate limiter; safe to use from worker threads. timeout bounds the
+# queueing and 429 retries, after which RateLimitError sends the user to the offline fallback
+def call_backend(prompt, session_id, timeout=None):
+    return rate_limiter.call(
+        lambda: backend.generate(prompt), session_id, tokens=estimate_tokens(prompt), timeout=timeout
+    )
+
+def stream_backend(prompt, session_id, timeout=None):
+    # Backend streams are lazy, so pull the first piece inside the limiter to catch 429s there
+    def open_stream():
+        pieces = iter(backend.stream(prompt))
+        return pieces, next(pieces, "")
+
+    pieces, first = rate_limiter.call(open_stream, session_id, tokens=estimate_tokens(prompt), timeout=timeout)
+    yield first
+    yield from pieces
+
+# Assemble a quiz from banked questions when bank mode is on and the bank has enough of each difficulty
+def draw_from_bank(doc_hash, num_easy, num_mid, num_hard, language):
+    if not st.session_state.get("bank_mode"):
+        return None
+    quiz = question_bank.draw(doc_hash, language, num_easy, num_mid, num_hard)
+    if quiz:
+        metrics.increment("quiz_source", source="bank")
+        t = translations[language]
+        st.toast(t["drawn_from_bank"].format(count=sum(question_bank.counts(doc_hash, language).values())))
+    return quiz
+
+# Questions built from the text without the model, for when it is unavailable, failing or backed up
+def offline_questions(text, num_easy, num_mid, num_hard, language, message):
+    if not st.session_state.get("offline_mode"):
+        return None
+    from offline_questions import generate_offline  # Loads the passage index and numpy only when needed
+    questions = generate_offline(text, num_easy, num_mid, num_hard, language)
+    if questions:
+        metrics.increment("quiz_source", source="offline")
+        st.toast(message)
+    return questions
+
+# Questions to serve instead of calling the model, or None to call it. With no backend this is the offline
+# quiz, or [] after reporting the API error; when the model is backed up (quota exceeded or backing off, so
+# the shared limiter would queue us for long) it is the offline quiz if there is one
+def offline_instead_of_model(text, num_easy, num_mid, num_hard, language):
+    t = translations[language]
+    if not backend:
+        offline = offline_questions(text, num_easy, num_mid, num_hard, language, t["offline_unavailable"])
+        if not offline:
+            st.error(t["api_error"])
+        return offline or []
+    wait_time = rate_limiter.estimated_wait()
+    if wait_time > OFFLINE_AFTER_SECONDS:
+        return offline_questions(
+            text, num_easy, num_mid, num_hard, language, t["offline_busy"].format(seconds=int(wait_time))
+        ) or None
+    return None
 
 # Generate quiz questions with rate limiting
 def generate_questions(text, total_questions, easy_pct, mid_pct, hard_pct):
     t = translations[st.session_state.language]
-    
-    # Rate limiting - 20 requests per minute
-    current_time = time.time()
-    if current_time - st.session_state.last_api_call < 3:  # 3 second cooldown
-        wait_time = int(3 - (current_time - st.session_state.last_api_call))
-        st.warning(t["api_wait"].format(seconds=wait_time))
-        time.sleep(wait_time)
-    
-    if not model:
-        st.error(t["api_error"])
-        return []
+    language = st.session_state.language
+    cancel_question_stream()
     
     if not text.strip():
         st.error("Please provide some text content")
         return []
 
-    num_easy = int(total_questions * (easy_pct / 100))
-    num_mid = int(total_questions * (mid_pct / 100))
-    num_hard = total_questions - num_easy - num_mid
-
-    if st.session_state.language == "ar":
-        prompt = f"""قم بإنشاء {total_questions} أسئلة اختيار من متعدد بصيغة JSON من النص التالي:
-{text[:3000]}
-كل سؤال يجب أن يكون بهذا الشكل:
-{{
-    "question": "...",
-    "options": ["خيار 1", "خيار 2", "خيار 3", "خيار 4"],
-    "correct": "A",
-    "difficulty": "easy|mid|hard",
-    "explanation": "..."
-}}
-المتطلبات:
-- {num_easy} أسئلة سهلة (استرجاع بسيط)
-- {num_mid} أسئلة متوسطة (تطبيق)
-- {num_hard} أسئلة صعبة (تحليل)
-- تأكد أن الإجابة الصحيحة هي 'A' أو 'B' أو 'C' أو 'D'
-- لا تُرجع سوى المصفوفة JSON، ولا شيء آخر"""
-    else:
-        prompt = f"""Generate {total_questions} multiple choice questions as a JSON array from this text:
-{text[:3000]}
-Format each question like this:
-{{
-    "question": "...",
-    "options": ["Option 1", "Option 2", "Option 3", "Option 4"],
-    "correct": "A",
-    "difficulty": "easy|mid|hard",
-    "explanation": "..."
-}}
-Requirements:
-- {num_easy} easy questions (basic recall)
-- {num_mid} medium questions (application)
-- {num_hard} hard questions (analysis)
-- Ensure correct answer is ONLY 'A', 'B', 'C', or 'D'
-- Only return the JSON array, nothing else"""
+    num_easy, num_mid, num_hard = split_counts(total_questions, easy_pct, mid_pct)
+    doc_hash = st.session_state.text_hash
+    banked = draw_from_bank(doc_hash, num_easy, num_mid, num_hard, language)
+    if banked:
+        return banked
+
+    # Serve repeated requests from the cache without touching the API
+    balanced = st.session_state.get("generation_mode") == "balanced"
+    cache = get_generation_cache()
+    cache_key = generation_cache_key(doc_hash, total_questions, num_easy, num_mid, num_hard, language, balanced)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        metrics.increment("quiz_source", source="cache")
+        return cached
+
+    session_id = st.session_state.session_id
+
+    # The user is waiting, so model calls give up after OFFLINE_AFTER_SECONDS; background runs do not
+    def generate(timeout=OFFLINE_AFTER_SECONDS):
+        if balanced:
+            with metrics.timer("generation_seconds", mode="balanced"):
+                questions, errors, skipped, report = generate_balanced(
+                    text, num_easy, num_mid, num_hard,
+                    lambda prompt: call_backend(prompt, session_id, timeout),
+                    language=language,
+                    token_budget=CONTEXT_TOKEN_BUDGET
+                )
+            for difficulty, count in report["delivered"].items():
+                metrics.increment("questions_delivered", count, difficulty=difficulty, mode="balanced")
+        else:
+            with metrics.timer("generation_seconds", mode="batch"):
+                questions, errors, skipped = generate_validated(
+                    text, num_easy, num_mid, num_hard,
+                    lambda prompt: call_backend(prompt, session_id, timeout),
+                    language=language,
+                    token_budget=CONTEXT_TOKEN_BUDGET
+                )
+        if questions:
+            question_bank.add_questions(doc_hash, language, questions)
+            # Only cache complete results so a partial failure or short quiz is retried next time
+            if not errors and len(questions) >= total_questions:
+                cache.set(cache_key, questions[:total_questions])
+        return questions, errors, skipped
+
+    offline = offline_instead_of_model(text, num_easy, num_mid, num_hard, language)
+    if offline is not None:
+        if offline and backend:
+            # Keep generating in the background so the model's quiz is cached and banked for next time
+            threading.Thread(
+                target=single_flight.do, args=(cache_key, lambda: generate(timeout=None), COALESCE_WAIT_SECONDS),
+                daemon=True
+            ).start()
+        return offline
+    warn_if_rate_limited()
 
     try:
-        st.session_state.last_api_call = time.time()
-        response = model.generate_content(prompt)
-        json_str = response.text.strip().replace('```json\n', '').replace('\n```', '')
-        questions = json.loads(json_str)
-        
-        # Validate all questions
-        validated_questions = []
-        for q in questions:
-            validated = validate_question(q)
-            if validated:
-                validated_questions.append(validated)
-            else:
-                st.warning(t["invalid_question"])
-                
-        return validated_questions[:total_questions]  # Ensure we don't exceed requested number
-        
-    except json.JSONDecodeError:
+        validated_questions, errors, skipped = single_flight.do(cache_key, generate, timeout=COALESCE_WAIT_SECONDS)
+    except SingleFlightTimeout:
+        st.error(t["coalesce_timeout"])
+        return []
+
+    for _ in range(skipped):
+        st.warning(t["invalid_question"])
+
+    if not validated_questions:
+        offline = errors and offline_questions(text, num_easy, num_mid, num_hard, language, t["offline_failed"])
+        if offline:
+            return offline
+        report_generation_errors(errors)
+        return []
+    metrics.increment("quiz_source", source="model")
+    if len(validated_questions) < total_questions:
+        st.toast(t["short_quiz"].format(delivered=len(validated_questions), requested=total_questions))
+
+    return validated_questions[:total_questions]  # Ensure we don't exceed requested number
+
+# Surface the most relevant failure from a generation run
+def report_generation_errors(errors):
+    if any(isinstance(e, RateLimitError) or "429" in str(e) for e in errors):
+        st.error("Quota exceeded. Please wait and try again.")
+    elif any(isinstance(e, json.JSONDecodeError) for e in errors):
         st.error("Failed to parse questions. Please try again with different content.")
+    elif errors:
+        st.error(f"Failed to generate questions: {str(errors[0])}")
+
+def cancel_question_stream():
+    if st.session_state.question_stream is not None:
+        st.session_state.question_stream.cancel()
+        st.session_state.question_stream = None
+
+# Number of questions in the current quiz, including ones still streaming in
+def quiz_total():
+    stream = st.session_state.question_stream
+    if stream is not None:
+        return stream.expected_total()
+    return len(st.session_state.questions)
+
+# Stream quiz questions: returns as soon as the first one is parsed while the rest keep filling in
+def stream_questions(text, total_questions, easy_pct, mid_pct, hard_pct):
+    t = translations[st.session_state.language]
+    language = st.session_state.language
+    cancel_question_stream()
+
+    if not text.strip():
+        st.error("Please provide some text content")
         return []
-    except Exception as e:
-        if "429" in str(e):
-            st.error("Quota exceeded. Please wait and try again.")
-            time.sleep(26)
-        else:
-            st.error(f"Failed to generate questions: {str(e)}")
+
+    num_easy, num_mid, num_hard = split_counts(total_questions, easy_pct, mid_pct)
+    doc_hash = st.session_state.text_hash
+    banked = draw_from_bank(doc_hash, num_easy, num_mid, num_hard, language)
+    if banked:
+        return banked
+
+    cache = get_generation_cache()
+    cache_key = generation_cache_key(doc_hash, total_questions, num_easy, num_mid, num_hard, language)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        metrics.increment("quiz_source", source="cache")
+        return cached
+
+    session_id = st.session_state.session_id
+
+    def on_finish(stream):
+        # Extras held in reserve are still valid questions, so they are banked too
+        question_bank.add_questions(doc_hash, language, stream.questions + stream.reserve)
+        if len(stream.questions) >= total_questions and not stream.errors:
+            cache.set(cache_key, stream.questions)
+
+    def start_stream(timeout=OFFLINE_AFTER_SECONDS):
+        return stream_validated(
+            text, num_easy, num_mid, num_hard,
+            lambda prompt: stream_backend(prompt, session_id, timeout),
+            language=language,
+            on_finish=on_finish,
+            token_budget=CONTEXT_TOKEN_BUDGET
+        )
+
+    offline = offline_instead_of_model(text, num_easy, num_mid, num_hard, language)
+    if offline is not None:
+        if offline and backend:
+            # A stream runs unwatched so it caches and banks its quiz for next time; one another
+            # session is already watching is left to that session, so its cancel() still works
+            single_flight.join(cache_key, lambda: start_stream(timeout=None), watch=False)
+        return offline
+    warn_if_rate_limited()
+    # A stream already running for the same request is shared rather than started again
+    stream = single_flight.join(cache_key, start_stream)
+    stream.wait_for(1)
+    if not stream.questions:
+        offline = stream.errors and offline_questions(
+            text, num_easy, num_mid, num_hard, language, t["offline_failed"]
+        )
+        if offline:
+            return offline
+        report_generation_errors(stream.errors)
+        return []
+    metrics.increment("quiz_source", source="model")
+    st.session_state.question_stream = stream
+    return stream.questions
+
+# Lazy mode: generate a small first page now and later pages as the user works through them,
+# each with a difficulty mix adapted to how they are doing so far
+def paged_questions(text, total_questions, easy_pct, mid_pct, hard_pct):
+    language = st.session_state.language
+    cancel_question_stream()
+
+    if not text.strip():
+        st.error("Please provide some text content")
         return []
+    offline = offline_instead_of_model(text, *split_counts(total_questions, easy_pct, mid_pct), language)
+    if offline is not None:
+        return offline
+
+    warn_if_rate_limited()
+    session_id = st.session_state.session_id
+    doc_hash = st.session_state.text_hash
+    use_bank = bool(st.session_state.get("bank_mode"))
+    use_offline = bool(st.session_state.get("offline_mode"))
+    quiz = PagedQuiz(
+        total_questions, easy_pct, mid_pct,
+        lambda num_easy, num_mid, num_hard, asked: produce_quiz(
+            text, doc_hash, (num_easy, num_mid, num_hard), language, asked, session_id, use_bank, check=quiz.check,
+            use_offline=use_offline, timeout=OFFLINE_AFTER_SECONDS
+        )
+    )
+    with metrics.timer("first_question_seconds", mode="lazy"):
+        questions = quiz.start()
+    if not questions:
+        report_generation_errors(quiz.errors)
+        return []
+    st.session_state.question_stream = quiz
+    return questions
+
+# In lazy mode, ask for the next page once the user nears the end of the generated questions
+def request_next_page():
+    quiz = st.session_state.question_stream
+    if isinstance(quiz, PagedQuiz):
+        results = difficulty_results(st.session_state.questions, st.session_state.user_answers)
+        quiz.advance(st.session_state.current_question, results)
+
+# Identifies a prefetch by document, settings and the questions it must not repeat
+def prefetch_key(doc_hash, total_questions, easy_pct, mid_pct, asked):
+    language = st.session_state.language
+    counts = split_counts(total_questions, easy_pct, mid_pct)
+    return make_cache_key(generation_cache_key(doc_hash, total_questions, *counts, language), *asked)
+
+# Questions not yet asked, from the bank if allowed or else the model, falling back to offline questions
+# if allowed and the model fails; runs in background threads, so it must not touch Streamlit.
+# check() is called before each model call to allow cancellation; timeout is passed to call_backend.
+def produce_quiz(text, doc_hash, counts, language, asked, session_id, use_bank, check=None, use_offline=False, timeout=None):
+    if use_bank:
+        quiz = question_bank.draw(doc_hash, language, *counts, exclude=asked)
+        if quiz:
+            metrics.increment("quiz_source", source="bank")
+            return quiz
+
+    def generate_text(prompt):
+        if check:
+            check()
+        return call_backend(prompt, session_id, timeout)
+
+    questions, errors, _ = generate_validated(
+        text, *counts, generate_text,
+        language=language,
+        avoid=asked,
+        token_budget=CONTEXT_TOKEN_BUDGET
+    )
+    if not questions and errors and use_offline:
+        metrics.increment("quiz_source", source="offline")
+        from offline_questions import generate_offline
+        return generate_offline(text, *counts, language, avoid=asked)
+    if questions:
+        metrics.increment("quiz_source", source="model")
+    question_bank.add_questions(doc_hash, language, questions)
+    return questions
+
+# While a quiz is under way, prepare the next one for the same document and settings
+def prefetch_next_quiz(total_questions, easy_pct, mid_pct):
+    session_id = st.session_state.session_id
+    doc_hash = st.session_state.text_hash
+    text = current_text()
+    if not st.session_state.get("prefetch_mode") or not backend or not text.strip():
+        prefetcher.cancel(session_id)
+        return
+    stream = st.session_state.question_stream
+    if stream is not None and not stream.done:
+        return  # Let the current quiz finish streaming before competing with it for the API
+    asked = [q["question"] for q in st.session_state.questions]
+    counts = split_counts(total_questions, easy_pct, mid_pct)
+    language = st.session_state.language
+    use_bank = bool(st.session_state.get("bank_mode"))
+    prefetcher.start(
+        session_id,
+        prefetch_key(doc_hash, total_questions, easy_pct, mid_pct, asked),
+        lambda job: produce_quiz(text, doc_hash, counts, language, asked, session_id, use_bank, check=job.check)
+    )
+
+# The prefetched quiz following the current one, or None if prefetch is off or it failed
+def take_prefetched_quiz(total_questions, easy_pct, mid_pct):
+    session_id = st.session_state.session_id
+    if not st.session_state.get("prefetch_mode"):
+        return None
+    asked = [q["question"] for q in st.session_state.questions]
+    key = prefetch_key(st.session_state.text_hash, total_questions, easy_pct, mid_pct, asked)
+    quiz = prefetcher.take(session_id, key, timeout=PREFETCH_WAIT_SECONDS)
+    if quiz is None:
+        prefetcher.cancel(session_id)
+    return quiz
 
 # Main App UI
 t = translations[st.session_state.language]
@@ -310,6 +705,23 @@ with st.sidebar:
     mid_pct = st.slider("% Medium" if st.session_state.language == "en" else "% متوسطة", 0, 100, 50)
     hard_pct = 100 - easy_pct - mid_pct
     st.metric("Hard" if st.session_state.language == "en" else "صعبة", f"{hard_pct}%")
+    # Keys rather than labels are stored, so the selected mode survives a language switch
+    generation_modes = {
+        "stream": "Show questions as they are generated" if st.session_state.language == "en" else "عرض الأسئلة فور إنشائها",
+        "batch": "Generate the whole quiz at once" if st.session_state.language == "en" else "إنشاء الاختبار كاملاً دفعة واحدة",
+        "balanced": "Generate each difficulty separately and replace rejected questions" if st.session_state.language == "en" else "إنشاء كل مستوى صعوبة على حدة واستبدال الأسئلة المرفوضة",
+        "lazy": "Generate questions in small batches as you go, adapting difficulty to your answers" if st.session_state.language == "en" else "إنشاء الأسئلة على دفعات صغيرة أثناء الحل مع تكييف الصعوبة حسب إجاباتك",
+    }
+    generation_mode = st.radio(
+        "Generation mode" if st.session_state.language == "en" else "طريقة الإنشاء",
+        list(generation_modes),
+        format_func=generation_modes.get,
+        key="generation_mode"
+    )
+    generate_quiz = {"stream": stream_questions, "lazy": paged_questions}.get(generation_mode, generate_questions)
+    st.checkbox("Draw quiz from saved questions when possible" if st.session_state.language == "en" else "سحب الاختبار من الأسئلة المحفوظة عند الإمكان", value=True, key="bank_mode")
+    st.checkbox("Prepare the next quiz in the background" if st.session_state.language == "en" else "تجهيز الاختبار التالي في الخلفية", value=False, key="prefetch_mode")
+    st.checkbox("Use questions built directly from the text when the AI model is unavailable or busy" if st.session_state.language == "en" else "استخدام أسئلة مبنية مباشرة من النص عندما يكون نموذج الذكاء الاصطناعي غير متاح أو مشغولاً", value=True, key="offline_mode")
     st.markdown("### 🔒 Security Note")
     st.markdown("Your API key is securely stored" if st.session_state.language == "en" else "مفتاح API الخاص بك مخزن بأمان")
 
@@ -329,20 +741,20 @@ if input_method == t["upload_file_option"]:
         key="file_uploader"
     )
     if uploaded_file:
-        st.session_state.text_content = extract_text_from_file(uploaded_file)
-        if st.session_state.text_content.strip():
+        text, st.session_state.text_hash = extract_text_from_file(uploaded_file)
+        if text.strip():
             st.success(t["file_uploaded_successfully"])
             if st.button(t["generate_questions_button"], key="generate_from_file"):
                 with st.spinner(t["generating_questions"]):
-                    st.session_state.questions = generate_questions(
-                        st.session_state.text_content,
+                    st.session_state.questions = generate_quiz(
+                        text,
                         total_questions,
                         easy_pct,
                         mid_pct,
                         hard_pct
                     )
                     if st.session_state.questions:
-                        st.session_state.user_answers = []
+                        st.session_state.user_answers = AnswerLog()
                         st.session_state.score = 0
                         st.session_state.current_question = 0
                         st.session_state.quiz_complete = False
@@ -350,32 +762,52 @@ if input_method == t["upload_file_option"]:
         else:
             st.warning(t["empty_file_warning"])
 else:
-    st.session_state.text_content = st.text_area(
+    # The widget keeps its own copy; the session itself only keeps the hash
+    text = st.text_area(
         t["enter_text_option"],
         height=200,
-        value=st.session_state.text_content,
+        value=current_text(),
         key="text_input"
     )
-    if st.session_state.text_content.strip():
+    st.session_state.text_hash = text_store.put(text) if text.strip() else None
+    if text.strip():
         if st.button(t["generate_questions_button"], key="generate_from_text"):
             with st.spinner(t["generating_questions"]):
-                st.session_state.questions = generate_questions(
-                    st.session_state.text_content,
+                st.session_state.questions = generate_quiz(
+                    text,
                     total_questions,
                     easy_pct,
                     mid_pct,
                     hard_pct
                 )
                 if st.session_state.questions:
-                    st.session_state.user_answers = []
+                    st.session_state.user_answers = AnswerLog()
                     st.session_state.score = 0
                     st.session_state.current_question = 0
                     st.session_state.quiz_complete = False
                     st.rerun()
 
-# Quiz Display Logic
-if st.session_state.questions and not st.session_state.quiz_complete:
+# While a quiz is under way the quiz panel starts the prefetch, since answers only rerun that panel
+if st.session_state.questions and st.session_state.quiz_complete:
+    prefetch_next_quiz(total_questions, easy_pct, mid_pct)
+
+# Answering a question reruns only this panel, not the document input and sidebar above it
+@st.fragment
+def quiz_panel():
+    panel_started = time.perf_counter()
     try:
+        request_next_page()
+        # Checked on every answer, so the prefetch starts as soon as the current quiz has finished streaming
+        prefetch_next_quiz(total_questions, easy_pct, mid_pct)
+        # Wait for the next streamed question if the user has caught up with the model
+        stream = st.session_state.question_stream
+        if stream is not None and st.session_state.current_question >= len(st.session_state.questions):
+            with st.spinner(t["generating_questions"]):
+                stream.wait_for(st.session_state.current_question + 1)
+            if st.session_state.current_question >= len(st.session_state.questions):
+                st.session_state.quiz_complete = True
+                st.rerun()
+
         q = st.session_state.questions[st.session_state.current_question]
         
         # Ensure options_dict is properly formatted
@@ -383,7 +815,7 @@ if st.session_state.questions and not st.session_state.quiz_complete:
         
         st.subheader(t["question_format"].format(
             current=st.session_state.current_question + 1,
-            total=len(st.session_state.questions)
+            total=quiz_total()
         ))
 
         difficulty_color = 'green' if q['difficulty'] == 'easy' else 'orange' if q['difficulty'] == 'mid' else 'red'
@@ -397,33 +829,26 @@ if st.session_state.questions and not st.session_state.quiz_complete:
         def format_option(x):
             return f"{x}) {options_dict[x]}" if st.session_state.language == "en" else f"{options_dict[x]} ) {x}"
 
-        selected_key = st.radio(
+        # Plain labels mapped back to option keys, rather than format_func, so the value survives reruns as-is
+        labels = {format_option(key): key for key in options_dict}
+        selected_key = labels[st.radio(
             t["select_answer"],
-            options=list(options_dict.keys()),
-            format_func=format_option,
+            options=list(labels),
             key=f"q_{st.session_state.current_question}"
-        )
+        )]
 
         if st.button(t["submit_answer"], key=f"submit_{st.session_state.current_question}"):
             is_correct = selected_key == q['correct']
-            st.session_state.user_answers.append({
-                "question": q['question'],
-                "selected": options_dict[selected_key],
-                "selected_key": selected_key,
-                "correct": options_dict.get(q['correct'], "N/A"),
-                "correct_key": q['correct'],
-                "explanation": q['explanation'],
-                "is_correct": is_correct
-            })
+            st.session_state.user_answers.append(st.session_state.current_question, selected_key, is_correct)
             if is_correct:
                 st.session_state.score += 1
                 st.success(t["correct"])
             else:
                 st.error(t["incorrect"].format(correct=q['correct']))
             st.markdown(f"**{t['explanation']}** {q['explanation']}")
-            if st.session_state.current_question < len(st.session_state.questions) - 1:
+            if st.session_state.current_question < quiz_total() - 1:
                 st.session_state.current_question += 1
-                st.rerun()
+                rerun_quiz_panel()
             else:
                 st.session_state.quiz_complete = True
                 st.rerun()
@@ -431,13 +856,22 @@ if st.session_state.questions and not st.session_state.quiz_complete:
     except Exception as e:
         st.error(t["question_error"].format(error=str(e)))
         st.session_state.current_question += 1
-        if st.session_state.current_question >= len(st.session_state.questions):
+        if st.session_state.current_question >= quiz_total():
             st.session_state.quiz_complete = True
         st.rerun()
+    metrics.observe("rerun_seconds", time.perf_counter() - panel_started, scope="quiz")
 
-# Quiz Completion Screen
-if st.session_state.quiz_complete:
-    st.balloons()
+# Rerun only the quiz panel when that is what is running; a full app run (the first one after a quiz
+# starts) can only rerun in full
+def rerun_quiz_panel():
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# Results and answer review; balloons stay outside so they are not replayed by a panel-only rerun
+@st.fragment
+def results_panel():
     st.success(t["quiz_completed"])
 
     correct = st.session_state.score
@@ -452,41 +886,51 @@ if st.session_state.quiz_complete:
         st.metric(t["percentage"], f"{percentage:.1f}%")
 
     st.subheader(t["performance_by_difficulty"])
-    difficulty_stats = {"Easy": 0, "Medium": 0, "Hard": 0}
-    for q, ans in zip(st.session_state.questions, st.session_state.user_answers):
-        if ans['is_correct']:
-            if q['difficulty'] == 'easy':
-                difficulty_stats["Easy"] += 1
-            elif q['difficulty'] == 'mid':
-                difficulty_stats["Medium"] += 1
-            elif q['difficulty'] == 'hard':
-                difficulty_stats["Hard"] += 1
+    results = difficulty_results(st.session_state.questions, st.session_state.user_answers)
+    difficulty_stats = {"Easy": results["easy"][0], "Medium": results["mid"][0], "Hard": results["hard"][0]}
     st.bar_chart(difficulty_stats)
 
     st.subheader(t["detailed_review"])
     for i, ans in enumerate(st.session_state.user_answers, 1):
-        with st.expander(f"Question {i}: {ans['question']}" if st.session_state.language == "en" else f"السؤال {i}: {ans['question']}", expanded=False):
-            status = "✅ Correct" if ans['is_correct'] else "❌ Incorrect"
-            st.markdown(f"{t['your_answer']} {status} {ans['selected_key']}) {ans['selected']}")
-            if not ans['is_correct']:
-                st.markdown(f"{t['correct_answer']} {ans['correct_key']}) {ans['correct']}")
-            st.markdown(f"**Explanation:** {ans['explanation']}")
-
+        q = st.session_state.questions[ans.question_index]
+        options_dict = {chr(65 + j): opt for j, opt in enumerate(q['options'])}
+        with st.expander(f"Question {i}: {q['question']}" if st.session_state.language == "en" else f"السؤال {i}: {q['question']}", expanded=False):
+            status = "✅ Correct" if ans.is_correct else "❌ Incorrect"
+            st.markdown(f"{t['your_answer']} {status} {ans.selected_key}) {options_dict[ans.selected_key]}")
+            if not ans.is_correct:
+                st.markdown(f"{t['correct_answer']} {q['correct']}) {options_dict.get(q['correct'], 'N/A')}")
+            st.markdown(f"**Explanation:** {q['explanation']}")
+
+    # A new quiz changes the whole page, so it reruns the full app
     if st.button(t["start_new_quiz"]):
-        st.session_state.questions = []
+        cancel_question_stream()
+        with st.spinner(t["generating_questions"]):
+            next_quiz = take_prefetched_quiz(total_questions, easy_pct, mid_pct)
+        st.session_state.questions = next_quiz or []
         st.session_state.current_question = 0
         st.session_state.score = 0
-        st.session_state.user_answers = []
+        st.session_state.user_answers = AnswerLog()
         st.session_state.quiz_complete = False
         st.rerun()
 
+# Quiz Display Logic
+if st.session_state.questions and not st.session_state.quiz_complete:
+    quiz_panel()
+
+# Quiz Completion Screen
+if st.session_state.quiz_complete:
+    st.balloons()
+    results_panel()
+
 # Reset Button
 if st.session_state.questions and not st.session_state.quiz_complete:
     if st.button(t["reset_quiz"]):
+        cancel_question_stream()
+        prefetcher.cancel(st.session_state.session_id)
         st.session_state.questions = []
         st.session_state.current_question = 0
         st.session_state.score = 0
-        st.session_state.user_answers = []
+        st.session_state.user_answers = AnswerLog()
         st.session_state.quiz_complete = False
         st.rerun()
 
@@ -495,3 +939,8 @@ st.caption(t["note"])
 
 # Close RTL div
 st.markdown('</div>', unsafe_allow_html=True)
+
+# Script runs cut short by st.rerun() are not timed; the run they trigger is
+metrics.observe("rerun_seconds", time.perf_counter() - run_started, scope="app")
+if METRICS_PATH:
+    metrics.write_every(METRICS_PATH, METRICS_WRITE_SECONDS)
@@ -1,22 +1,108 @@
 import re
 
+ARABIC_RANGES = r'\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF'
+
+# Anything that is neither Arabic nor whitespace
+UNWANTED_PATTERN = re.compile(f'[^{ARABIC_RANGES}\\s]+')
+
+# The old code inserted a tatweel after ال following a space, then removed tatweels
+# between two non-spaces. The insertions always cancel out, but they consume the
+# character after ال, which stops that character taking part in a tatweel removal.
+# Matching both cases left to right in one pattern reproduces that exactly.
+TATWEEL_PATTERN = re.compile(r'(\sال\S)|(\S)ـ(\S)')
+# Neither case can span whitespace, so only words containing a tatweel need the pattern
+TATWEEL_WORD_PATTERN = re.compile(r'(?<!\S)\S*ـ\S*')
+TATWEEL = 'ـ'
+
+
+def _normalize_chars(text):
+    # Two C-level replaces measure several times faster than str.translate here
+    return UNWANTED_PATTERN.sub('', text.replace('ى', 'ي').replace('ك', 'ک'))
+
+
+def _fix_tatweel_word(match):
+    word = match.group(0)
+    if match.start() == 0:
+        return TATWEEL_PATTERN.sub(r'\1\2\3', word)
+    # Preceded by whitespace, so ال at the start of the word counts
+    return TATWEEL_PATTERN.sub(r'\1\2\3', ' ' + word)[1:]
+
+
+def _normalize_segment(text):
+    """Fix tatweels in text already passed through _normalize_chars; returns its words"""
+    if TATWEEL in text:
+        text = TATWEEL_WORD_PATTERN.sub(_fix_tatweel_word, text)
+    return text.split()
+
+
 def fix_arabic_text(text):
     """Clean and normalize Arabic text"""
     if not text:
         return text
-    
+    return ' '.join(_normalize_segment(_normalize_chars(text)))
+
+
+def fix_arabic_pages(pages):
+    """Normalize a list of page texts, one result per page"""
+    return [fix_arabic_text(page) for page in pages]
+
+
+class ArabicNormalizer:
+    """Streaming fix_arabic_text: feed chunks in order and get normalized text back.
+
+    Concatenating every feed() result and finish() gives exactly
+    fix_arabic_text(''.join(chunks)), however the chunks are split. Text after
+    the last whitespace of the input so far is held back until more arrives.
+    """
+
+    def __init__(self):
+        self._pending = ''
+        self._emitted = False
+
+    def _emit(self, words):
+        if not words:
+            return ''
+        text = ' '.join(words)
+        if self._emitted:
+            text = ' ' + text
+        self._emitted = True
+        return text
+
+    def feed(self, chunk):
+        # Character normalization is per character, so it is safe on any chunk
+        self._pending += _normalize_chars(chunk)
+        # No match spans a whitespace character from the left, so cutting just before one is safe
+        cut = len(self._pending)
+        while cut > 0 and not self._pending[cut - 1].isspace():
+            cut -= 1
+        cut -= 1
+        if cut <= 0:
+            return ''
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._emit(_normalize_segment(ready))
+
+    def finish(self):
+        ready, self._pending = self._pending, ''
+        return self._emit(_normalize_segment(ready))
+
+
+def _fix_arabic_text_multipass(text):
+    """Original multi-pass implementation, kept as the reference for equivalence checks and benchmarks"""
+    if not text:
+        return text
+
     # Normalize Arabic characters
     text = text.replace('ى', 'ي')
     text = text.replace('ك', 'ک')
-    
+
     # Remove unwanted characters
     text = re.sub(r'[^\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF\s]', '', text)
-    
+
     # Fix common issues
     text = re.sub(r'(\s)ال(\S)', r'\1الـ\2', text)  # Fix ال التعريف
     text = re.sub(r'(\S)ـ(\S)', r'\1\2', text)  # Remove unnecessary tatweel
-    
+
     # Normalize whitespace
     text = ' '.join(text.split())
-    
+
     return text
@@ -0,0 +1,195 @@
+"""Generate question banks for many documents without the Streamlit UI.
+
+Input is either a directory of .pdf/.txt files or a JSONL file where each line
+has an id ("id" or "request_id") and either a "path" or inline "text"/"body".
+Per-line "num_questions", "easy_pct", "mid_pct" and "language" override the
+command-line defaults. Results are appended to the output JSONL as each document
+finishes; rerunning with the same output skips documents already done.
+
+    python batch_cli.py handouts/ -o bank.jsonl --backend gemini --concurrency 4
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from json_parsing import repair_stats
+from layout_cleanup import LayoutCleaner
+from llm_backends import create_backend
+from metrics import metrics
+from question_bank import QuestionBank, document_hash
+from question_pipeline import generate_validated, split_counts
+from rate_limiter import RateLimiter, estimate_tokens
+from text_processor import extract_text_from_pdf
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")
+
+
+def load_jobs(source, defaults):
+    """Read the documents to process from a directory or a JSONL file"""
+    jobs = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                jobs.append(dict(defaults, id=name, path=os.path.join(source, name)))
+        return jobs
+    with open(source, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            job = dict(defaults)
+            job.update({k: v for k, v in record.items() if k in defaults})
+            job["id"] = str(record.get("id") or record.get("request_id") or line_number)
+            if "path" in record:
+                job["path"] = record["path"]
+            else:
+                job["text"] = record.get("text") or record.get("body") or ""
+            jobs.append(job)
+    return jobs
+
+
+def completed_ids(output_path):
+    """IDs already written successfully to the output, for resume-on-restart"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by an interrupted run
+            if record.get("questions"):
+                done.add(record["id"])
+    return done
+
+
+def extract_text(path):
+    """Extraction entry point for worker processes; returns (text, layout cleanup stats or None)"""
+    if path.lower().endswith(".pdf"):
+        cleaner = LayoutCleaner()
+        return extract_text_from_pdf(path, separator="\n", cleaner=cleaner), cleaner.stats()
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read(), None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Directory of PDF/TXT files or a JSONL file of requests")
+    parser.add_argument("-o", "--output", default="question_bank.jsonl")
+    parser.add_argument("--backend", default=os.environ.get("QUIZ_LLM_BACKEND", "gemini"))
+    parser.add_argument("--model", default=os.environ.get("QUIZ_MODEL_NAME"))
+    parser.add_argument("--num-questions", type=int, default=10)
+    parser.add_argument("--easy-pct", type=int, default=30)
+    parser.add_argument("--mid-pct", type=int, default=50)
+    parser.add_argument("--language", default="en", choices=["en", "ar"])
+    parser.add_argument("--concurrency", type=int, default=4, help="Documents generated at once")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--requests-per-minute", type=int, default=15)
+    parser.add_argument("--bank", help="Also store every validated question in this SQLite question bank")
+    parser.add_argument("--metrics", help="Write stage latencies and token counts here (.prom for Prometheus text, "
+                                          "otherwise JSON)")
+    args = parser.parse_args(argv)
+
+    backend_kwargs = {}
+    if args.model:
+        backend_kwargs["model_name"] = args.model
+    if args.backend == "gemini":
+        if "GOOGLE_API_KEY" not in os.environ:
+            parser.error("GOOGLE_API_KEY must be set for the gemini backend")
+        backend_kwargs["api_key"] = os.environ["GOOGLE_API_KEY"]
+    backend = create_backend(args.backend, **backend_kwargs)
+    limiter = RateLimiter(requests_per_minute=args.requests_per_minute)
+    bank = QuestionBank(args.bank) if args.bank else None
+
+    defaults = {
+        "num_questions": args.num_questions,
+        "easy_pct": args.easy_pct,
+        "mid_pct": args.mid_pct,
+        "language": args.language,
+    }
+    jobs = load_jobs(args.source, defaults)
+    done = completed_ids(args.output)
+    pending = [job for job in jobs if job["id"] not in done]
+    print(f"{len(jobs)} documents, {len(jobs) - len(pending)} already done, {len(pending)} to process",
+          file=sys.stderr)
+
+    write_lock = threading.Lock()
+    totals = {"documents": 0, "failed": 0, "questions": 0, "characters": 0, "chars_saved": 0, "tokens_saved": 0}
+    start = time.perf_counter()
+
+    def generate(job, text, cleanup=None):
+        job_start = time.perf_counter()
+        num_easy, num_mid, num_hard = split_counts(job["num_questions"], job["easy_pct"], job["mid_pct"])
+        questions, errors, skipped = generate_validated(
+            text, num_easy, num_mid, num_hard,
+            lambda prompt: limiter.call(lambda: backend.generate(prompt), job["id"],
+                                        tokens=estimate_tokens(prompt)),
+            language=job["language"]
+        )
+        if bank is not None and questions:
+            bank.add_questions(document_hash(text), job["language"], questions)
+        metrics.observe("document_seconds", time.perf_counter() - job_start)
+        record = {
+            "id": job["id"],
+            "source": job.get("path"),
+            "language": job["language"],
+            "questions": questions,
+            "skipped": skipped,
+            "errors": [str(e) for e in errors],
+            "layout_cleanup": cleanup,
+            "seconds": round(time.perf_counter() - job_start, 3),
+        }
+        with write_lock:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            totals["documents"] += 1
+            totals["failed"] += 0 if questions else 1
+            totals["questions"] += len(questions)
+            totals["characters"] += len(text)
+            if cleanup:
+                totals["chars_saved"] += cleanup["chars_saved"]
+                totals["tokens_saved"] += cleanup["tokens_saved"]
+            print(f"[{totals['documents']}/{len(pending)}] {job['id']}: {len(questions)} questions",
+                  file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=args.extract_workers) as extractors, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as generators:
+        # Extraction and generation overlap: each document starts generating as soon as its text is ready
+        extracting = {extractors.submit(extract_text, job["path"]): job for job in pending if "path" in job}
+        generating = [generators.submit(generate, job, job["text"]) for job in pending if "path" not in job]
+        for future in as_completed(extracting):
+            job = extracting[future]
+            try:
+                text, cleanup = future.result()
+            except Exception as e:
+                print(f"{job['id']}: extraction failed: {e}", file=sys.stderr)
+                continue
+            generating.append(generators.submit(generate, job, text, cleanup))
+        for future in generating:
+            future.result()
+
+    elapsed = time.perf_counter() - start
+    summary = dict(
+        totals,
+        seconds=round(elapsed, 3),
+        documents_per_minute=round(totals["documents"] * 60 / elapsed, 2) if elapsed else 0.0,
+        questions_per_second=round(totals["questions"] / elapsed, 2) if elapsed else 0.0,
+        rate_limiter=limiter.metrics(),
+        json_repair=repair_stats.snapshot(),
+    )
+    if bank is not None:
+        summary["question_bank"] = bank.stats()
+    if args.metrics:
+        metrics.add_collector("rate_limiter", limiter.metrics)
+        metrics.add_collector("json_repair", repair_stats.snapshot)
+        metrics.write(args.metrics)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
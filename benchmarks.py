@@ -0,0 +1,612 @@
+"""Offline benchmarks for extraction, layout cleanup, prompt building, parsing, Arabic normalization, generation,
+per-session memory and app rerun latency.
+
+Everything runs locally: PDF fixtures are generated in memory and the model is
+FakeBackend with a fixed latency, so no network or API key is needed.
+
+    python benchmarks.py --pages 50 --latency 0.5 --runs 5
+    python benchmarks.py --suite --output bench.json
+    python benchmarks.py --suite --output new.json --baseline bench.json --threshold 1.25
+    python benchmarks.py --reruns 30 --runs 3
+
+With --baseline the exit status is 1 if any case got slower than threshold x its
+baseline median, so CI can flag regressions. The suite also exits 1 if the Arabic
+normalizer's batch or streaming output ever differs from the original multi-pass version.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from answer_log import AnswerLog
+from arabic_support_tools import ArabicNormalizer, _fix_arabic_text_multipass, fix_arabic_text
+from caching import TextStore
+from layout_cleanup import LayoutCleaner
+from llm_backends import FakeBackend
+from metrics import metrics
+from rate_limiter import RateLimiter, RateLimitError
+from question_pipeline import (
+    build_prompt,
+    generate_balanced,
+    generate_validated,
+    parse_questions,
+    plan_chunks,
+    select_context,
+    stream_validated,
+)
+
+SENTENCES = {
+    "en": "Section {page}.{n} explains how concept {n} relates to topic {page} in detail. ",
+    "ar": "يشرح القسم {page}.{n} كيف يرتبط المفهوم {n} بالموضوع {page} بالتفصيل. ",
+}
+RUNNING_LINES = {
+    "en": ("Course Pack - Introduction to the Topic", "Page {page} of {pages}"),
+    "ar": ("حزمة المقرر - مقدمة في الموضوع", "صفحة {page} من {pages}"),
+}
+SUITE_SIZES = (1, 50, 500)
+LINES_PER_PAGE = 45
+LINE_WIDTH = 80
+
+
+def synthetic_pages(pages, chars_per_page=3000, language="en"):
+    """List of page texts of roughly chars_per_page characters each"""
+    sentence = SENTENCES[language]
+    result = []
+    for page in range(pages):
+        page_text = []
+        length = 0
+        n = 0
+        while length < chars_per_page:
+            line = sentence.format(page=page, n=n)
+            page_text.append(line)
+            length += len(line)
+            n += 1
+        result.append("".join(page_text))
+    return result
+
+
+def synthetic_document(pages, chars_per_page=3000, language="en"):
+    """Text of roughly pages * chars_per_page characters"""
+    return "\n\n".join(synthetic_pages(pages, chars_per_page, language))
+
+
+def _wrap(text, width=LINE_WIDTH):
+    lines = []
+    while text:
+        cut = text.rfind(" ", 0, width) if len(text) > width else len(text)
+        cut = cut if cut > 0 else width
+        lines.append(text[:cut])
+        text = text[cut:].lstrip()
+    return lines[:LINES_PER_PAGE]
+
+
+def _pdf_string(line, unicode_font):
+    if unicode_font:
+        # Identity-H: each character is a 2-byte CID equal to its code point
+        return "<" + "".join(f"{ord(c):04X}" for c in line) + ">"
+    escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"({escaped})"
+
+
+def make_pdf(page_texts, language="en", running_lines=False):
+    """Build a text PDF in memory.
+
+    Arabic pages use a Type0 font with a ToUnicode map and no embedded glyphs:
+    invisible in a viewer, but extracted exactly like a real document. With
+    running_lines, every page gets a running header and a page-number footer.
+    """
+    unicode_font = language != "en"
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    if unicode_font:
+        cmap = (
+            "/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+            "/CMapName /Identity-Unicode def /CMapType 2 def\n"
+            "1 begincodespacerange <0000> <FFFF> endcodespacerange\n"
+            "3 beginbfrange <0020> <007E> <0020> <0600> <06FF> <0600> <FB50> <FEFF> <FB50> endbfrange\n"
+            "endcmap CMapName currentdict /CMap defineresource pop end end"
+        )
+        to_unicode = add(f"<< /Length {len(cmap)} >>\nstream\n{cmap}\nendstream")
+        descriptor = add(
+            "<< /Type /FontDescriptor /FontName /Synthetic /Flags 4 /FontBBox [0 0 1000 1000] "
+            "/ItalicAngle 0 /Ascent 800 /Descent -200 /CapHeight 700 /StemV 80 >>"
+        )
+        cid_font = add(
+            "<< /Type /Font /Subtype /CIDFontType2 /BaseFont /Synthetic "
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+            f"/FontDescriptor {descriptor} 0 R /DW 500 >>"
+        )
+        font = add(
+            "<< /Type /Font /Subtype /Type0 /BaseFont /Synthetic /Encoding /Identity-H "
+            f"/DescendantFonts [{cid_font} 0 R] /ToUnicode {to_unicode} 0 R >>"
+        )
+    else:
+        font = add("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for number, page_text in enumerate(page_texts, 1):
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        lines = _wrap(page_text)
+        if running_lines:
+            header, footer = RUNNING_LINES[language]
+            lines = [header] + lines + [footer.format(page=number, pages=len(page_texts))]
+        for line in lines:
+            ops.append(f"{_pdf_string(line, unicode_font)} Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops)
+        content = add(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {pages_obj} 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>"
+        ))
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_obj} 0 R >>"
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects[pages_obj - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\n"
+              f"startxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+def synthetic_questions(count):
+    """JSON array text of count valid questions, as a model would return it"""
+    questions = [{
+        "question": f"Which statement about concept {i} is correct?",
+        "options": [f"Statement {i}{letter}" for letter in "ABCD"],
+        "correct": "ABCD"[i % 4],
+        "difficulty": ("easy", "mid", "hard")[i % 3],
+        "explanation": f"Concept {i} is described in section {i // 10}.",
+    } for i in range(count)]
+    return "```json\n" + json.dumps(questions, indent=2) + "\n```"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        "runs": len(latencies),
+        "mean": statistics.mean(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies),
+    }
+
+
+def time_case(name, fn, repeats, **params):
+    """Run fn repeats times and return a result record"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    result = {"name": name, "params": params}
+    result.update(summarize(timings))
+    result["min"] = min(timings)
+    return result
+
+
+def bench_pipeline(backend, text, counts=(3, 5, 2), runs=5, concurrency=1):
+    """Time full batch generation, with `concurrency` simultaneous requests"""
+
+    def run_once(_):
+        start = time.perf_counter()
+        questions, errors, _ = generate_validated(text, *counts, backend.generate)
+        return time.perf_counter() - start, len(questions), len(errors)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run_once, range(runs)))
+    elapsed = time.perf_counter() - start
+    result = summarize([latency for latency, _, _ in results])
+    result["questions_per_second"] = sum(n for _, n, _ in results) / elapsed
+    result["errors"] = sum(e for _, _, e in results)
+    return result
+
+
+def bench_difficulty_split(backend, text, counts=(3, 5, 2), runs=5):
+    """Requested vs delivered counts and latency: one call per chunk vs per-difficulty calls with top-ups"""
+
+    def delivered(questions):
+        return {d: sum(q.get("difficulty") == d for q in questions) for d in ("easy", "mid", "hard")}
+
+    single, split = [], []
+    for _ in range(runs):
+        calls_before = backend.calls
+        start = time.perf_counter()
+        questions, _, skipped = generate_validated(text, *counts, backend.generate)
+        single.append((time.perf_counter() - start, delivered(questions), skipped, backend.calls - calls_before))
+        calls_before = backend.calls
+        questions, _, skipped, report = generate_balanced(text, *counts, backend.generate)
+        split.append((report["seconds"], report["delivered"], skipped, backend.calls - calls_before))
+
+    def describe(runs_):
+        return {
+            "latency": summarize([seconds for seconds, _, _, _ in runs_]),
+            "delivered": {d: sum(counts_[d] for _, counts_, _, _ in runs_) / len(runs_) for d in ("easy", "mid", "hard")},
+            "rejected": sum(skipped for _, _, skipped, _ in runs_) / len(runs_),
+            "calls": sum(calls for _, _, _, calls in runs_) / len(runs_),
+        }
+
+    return {
+        "requested": dict(zip(("easy", "mid", "hard"), counts)),
+        "single_call": describe(single),
+        "per_difficulty": describe(split),
+    }
+
+
+def bench_rate_limited(text, counts=(3, 5, 2), runs=5, rate_limit_rate=0.3, latency=0.05):
+    """Batch generation through the shared RateLimiter against a fake model that answers some calls with 429.
+
+    "retrying" honours a short retry hint, so runs should still deliver full
+    quizzes. "timeout" gives every call 0.2 s against a 1 s hint, so 429s must
+    end in RateLimitError promptly instead of blocking the caller.
+    """
+
+    def run(retry_after, timeout):
+        backend = FakeBackend(latency=latency, rate_limit_rate=rate_limit_rate, retry_after=retry_after, seed=1)
+        limiter = RateLimiter(requests_per_minute=6000, base_delay=0.01, max_delay=0.1)
+
+        def generate_text(prompt):
+            return limiter.call(lambda: backend.generate(prompt), "bench", timeout=timeout)
+
+        latencies, delivered, gave_up = [], [], 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            questions, errors, _ = generate_validated(text, *counts, generate_text)
+            latencies.append(time.perf_counter() - start)
+            delivered.append(len(questions))
+            gave_up += sum(isinstance(e, RateLimitError) for e in errors)
+        return {
+            "latency": summarize(latencies),
+            "delivered": sum(delivered) / runs,
+            "rate_limit_errors": gave_up,
+            "limiter": limiter.metrics(),
+        }
+
+    return {
+        "rate_limit_rate": rate_limit_rate,
+        "requested": sum(counts),
+        "retrying": run(retry_after=0.05, timeout=None),
+        "timeout": run(retry_after=1.0, timeout=0.2),
+    }
+
+
+def bench_session_memory(sessions=200, pages=50, answered=20):
+    """Session state bytes per session: own text copy and answer dicts vs a shared-store hash and an AnswerLog.
+
+    Every session takes a quiz on the same document, as a class would, and each
+    receives the text as its own string (pasted, or extracted again after
+    eviction). Widget values and the shared question list are not counted.
+    """
+    text = synthetic_document(pages)
+    questions = parse_questions(synthetic_questions(answered))[0]
+
+    def full_text_session():
+        answers = []
+        for q in questions:
+            options = {chr(65 + j): opt for j, opt in enumerate(q["options"])}
+            answers.append({
+                "question": q["question"],
+                "selected": options["A"],
+                "selected_key": "A",
+                "correct": options.get(q["correct"], "N/A"),
+                "correct_key": q["correct"],
+                "explanation": q["explanation"],
+                "is_correct": q["correct"] == "A",
+            })
+        return {"text_content": text.encode("utf-8").decode("utf-8"), "user_answers": answers}
+
+    store = TextStore()
+
+    def compact_session():
+        answers = AnswerLog()
+        for i, q in enumerate(questions):
+            answers.append(i, "A", q["correct"] == "A")
+        return {"text_hash": store.put(text.encode("utf-8").decode("utf-8")), "user_answers": answers}
+
+    def per_session(build):
+        tracemalloc.start()
+        try:
+            states = [build() for _ in range(sessions)]
+            used = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del states
+        return used / sessions
+
+    full, compact = per_session(full_text_session), per_session(compact_session)
+    return {
+        "sessions": sessions,
+        "document_chars": len(text),
+        "answers": answered,
+        "full_text_bytes_per_session": round(full),
+        "compact_bytes_per_session": round(compact),
+        "reduction": round(full / compact, 1) if compact else None,
+    }
+
+
+COLD_START_SCRIPT = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+AppTest.from_file(sys.argv[1], default_timeout=120).run()
+print(time.perf_counter() - start)
+"""
+
+
+def bench_app_reruns(answers=30, cold_starts=3):
+    """Cold start and per-answer rerun latency of app.py under Streamlit's AppTest, with the fake backend.
+
+    Cold start is the first script run in a fresh interpreter that has already
+    imported Streamlit, so it counts the app's own imports and setup. Each answer
+    then selects an option and submits it. AppTest always reruns the whole
+    script, which is what every answer cost before the quiz became a fragment;
+    in a browser an answer now reruns only the quiz fragment, whose time the app
+    records itself as rerun_seconds{scope="quiz"}.
+    """
+    from streamlit.testing.v1 import AppTest  # Only this benchmark needs Streamlit
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    workdir = tempfile.mkdtemp(prefix="quiz_bench_")
+    env = {
+        "QUIZ_LLM_BACKEND": "fake",
+        "QUIZ_BANK_PATH": os.path.join(workdir, "bank.sqlite3"),
+        "QUIZ_CACHE_DIR": os.path.join(workdir, "cache"),
+    }
+    cold = []
+    for _ in range(cold_starts):
+        result = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, app_path],
+            env=dict(os.environ, **env), cwd=workdir, capture_output=True, text=True, check=True,
+        )
+        cold.append(float(result.stdout.split()[-1]))
+
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        at = AppTest.from_file(app_path, default_timeout=60)
+        at.session_state["questions"] = parse_questions(synthetic_questions(answers))[0]
+        at.session_state["user_answers"] = AnswerLog()
+        at.run()
+        full_runs = []
+        for i in range(answers):
+            radio = at.radio(key=f"q_{i}")
+            radio.set_value(radio.options[i % len(radio.options)])
+            at.button(key=f"submit_{i}").click()
+            start = time.perf_counter()
+            at.run()
+            full_runs.append(time.perf_counter() - start)
+        completed = bool(at.session_state["quiz_complete"])
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    scopes = {
+        histogram["labels"].get("scope", "app"): {key: histogram[key] for key in ("count", "p50", "p99")}
+        for histogram in metrics.snapshot()["histograms"] if histogram["name"] == "rerun_seconds"
+    }
+    return {
+        "answers": answers,
+        "completed": completed,
+        "cold_start": summarize(cold),
+        "answer_full_rerun": dict(summarize(full_runs), p99=percentile(full_runs, 99)),
+        "rerun_seconds": scopes,
+    }
+
+
+def bench_streaming(backend, text, counts=(3, 5, 2), runs=5):
+    """Time to first question and to the full set in streaming mode"""
+    first, full = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        stream = stream_validated(text, *counts, backend.stream)
+        stream.wait_for(1)
+        first.append(time.perf_counter() - start)
+        stream.wait_for(stream.total)
+        full.append(time.perf_counter() - start)
+    return {"first_question": summarize(first), "all_questions": summarize(full)}
+
+
+def run_suite(sizes=SUITE_SIZES, repeats=3, latency=0.05):
+    """Time every stage on fixtures of each size and language"""
+    # Imported here so the pipeline benchmarks still run without PyPDF2 installed
+    from text_processor import extract_text_from_pdf
+    import passage_index
+
+    workers = os.cpu_count() or 1
+    results = []
+    for language in ("en", "ar"):
+        for pages in sizes:
+            page_texts = synthetic_pages(pages, language=language)
+            pdf = make_pdf(page_texts, language)
+            text = "\n".join(page_texts)
+            params = {"language": language, "pages": pages, "pdf_bytes": len(pdf)}
+            # The same call app.extract_text_from_file makes for an uploaded PDF
+            results.append(time_case(
+                "extract_text_from_file", repeats=repeats, **params,
+                fn=lambda: extract_text_from_pdf(BytesIO(pdf), separator="\n", workers=workers)
+            ))
+            results.append(time_case(
+                "extract_text_from_pdf", repeats=repeats, **params,
+                fn=lambda: extract_text_from_pdf(BytesIO(pdf))
+            ))
+            num_chunks, chunk_size = plan_chunks(10)
+
+            def select_cold():
+                # Clear the index cache so every repeat pays for building the passage index
+                passage_index._index_cache.clear()
+                return select_context(text, num_chunks, chunk_size)
+
+            results.append(time_case(
+                "select_context", repeats=repeats, language=language, pages=pages, fn=select_cold
+            ))
+            # The index is cached by now, as it is for a second quiz on the same document
+            results.append(time_case(
+                "build_prompts", repeats=repeats, language=language, pages=pages,
+                fn=lambda: [
+                    build_prompt(chunk, 1, 1, 1, language)
+                    for chunk in select_context(text, num_chunks, chunk_size)
+                ]
+            ))
+            noisy_pdf = make_pdf(page_texts, language, running_lines=True)
+            cleaners = []
+
+            def extract_cleaned():
+                cleaners.append(LayoutCleaner())
+                return extract_text_from_pdf(BytesIO(noisy_pdf), separator="\n", cleaner=cleaners[-1])
+
+            result = time_case("extract_text_from_pdf_cleaned", repeats=repeats, **params, fn=extract_cleaned)
+            result["layout_cleanup"] = cleaners[-1].stats()
+            results.append(result)
+            if language == "ar":
+                results.append(time_case(
+                    "extract_text_from_pdf_normalized", repeats=repeats, **params,
+                    fn=lambda: extract_text_from_pdf(BytesIO(pdf), separator="\n", normalizer=ArabicNormalizer())
+                ))
+                megabytes = len(text.encode("utf-8")) / 1e6
+                for name, normalize in (("fix_arabic_text", fix_arabic_text),
+                                        ("fix_arabic_text_multipass", _fix_arabic_text_multipass)):
+                    result = time_case(name, repeats=repeats, pages=pages, chars=len(text),
+                                       fn=lambda: normalize(text))
+                    result["mb_per_second"] = megabytes / result["p50"] if result["p50"] else None
+                    results.append(result)
+
+    for count in (100, 1000, 10000):
+        raw = synthetic_questions(count)
+        results.append(time_case(
+            "parse_and_validate", repeats=repeats, questions=count, chars=len(raw),
+            fn=lambda: parse_questions(raw)
+        ))
+
+    backend = FakeBackend(latency=latency)
+    text = synthetic_document(max(sizes))
+    results.append(time_case(
+        "generate_validated", repeats=repeats, latency=latency, pages=max(sizes),
+        fn=lambda: generate_validated(text, 3, 5, 2, backend.generate)
+    ))
+    return results
+
+
+def arabic_equivalence_mismatches(samples=20000, seed=0):
+    """Inputs where fix_arabic_text or ArabicNormalizer disagree with the multi-pass original"""
+    pieces = ["ا", "ل", "ـ", "ب", "م", "ى", "ك", " ال", "الـ", "ـــ",
+              " ", "\n", "\t", "\xa0", "\u3000", "x", "1", ".", "é"]
+    rng = random.Random(seed)
+    inputs = [synthetic_document(2, language="ar"), synthetic_document(2, language="en")]
+    inputs += ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 24))) for _ in range(samples)]
+    mismatches = []
+    for text in inputs:
+        expected = _fix_arabic_text_multipass(text)
+        normalizer = ArabicNormalizer()
+        streamed = "".join(normalizer.feed(text[i:i + 3]) for i in range(0, len(text), 3))
+        streamed += normalizer.finish()
+        if fix_arabic_text(text) != expected or streamed != expected:
+            mismatches.append(text)
+    return mismatches
+
+
+def _case_key(result):
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+
+def find_regressions(results, baseline, threshold):
+    """Cases whose median exceeds threshold x the baseline median"""
+    previous = {_case_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(_case_key(result))
+        if old and old["p50"] > 0 and result["p50"] > threshold * old["p50"]:
+            regressions.append({
+                "name": result["name"],
+                "params": result["params"],
+                "baseline_p50": old["p50"],
+                "p50": result["p50"],
+                "ratio": result["p50"] / old["p50"],
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake model latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--sessions", type=int, default=200, help="Concurrent sessions for the memory benchmark")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Share of fake questions that fail validation")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.3, help="Share of fake calls answered with 429")
+    parser.add_argument("--suite", action="store_true", help="Run the per-stage benchmark suite")
+    parser.add_argument("--reruns", type=int, default=0, help="Answer this many questions in app.py under AppTest and time the reruns")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SUITE_SIZES))
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Previous --suite output to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    if args.reruns:
+        report = {"app_reruns": bench_app_reruns(args.reruns, cold_starts=args.runs)}
+    elif args.suite:
+        report = {
+            "results": run_suite(args.sizes, repeats=args.runs, latency=args.latency),
+            "arabic_equivalence_mismatches": arabic_equivalence_mismatches(),
+        }
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)["results"]
+            report["regressions"] = find_regressions(report["results"], baseline, args.threshold)
+    else:
+        backend = FakeBackend(latency=args.latency, failure_rate=args.failure_rate, invalid_rate=args.invalid_rate)
+        text = synthetic_document(args.pages)
+        report = {
+            "pages": args.pages,
+            "latency": args.latency,
+            "batch": bench_pipeline(backend, text, runs=args.runs, concurrency=args.concurrency),
+            "streaming": bench_streaming(backend, text, runs=args.runs),
+            "difficulty_split": bench_difficulty_split(backend, text, runs=args.runs),
+            "session_memory": bench_session_memory(args.sessions, args.pages),
+            "rate_limited": bench_rate_limited(text, runs=args.runs, rate_limit_rate=args.rate_limit_rate),
+        }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+    if report.get("regressions") or report.get("arabic_equivalence_mismatches"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
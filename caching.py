@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from question_bank import document_hash
+
+
+def make_cache_key(*parts):
+    """Build a stable hex key from the given parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")  # Separator so ("ab", "c") != ("a", "bc")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory cache that evicts the least recently used entry.
+
+    When max_bytes is set, entries are also evicted until the summed sizeof(value)
+    fits the budget; a single value larger than the budget is not stored.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.total_bytes > self.max_bytes
+            ):
+                self._discard(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, default)
+            self._discard(key)
+            return value
+
+    def _discard(self, key):
+        if key in self._data:
+            del self._data[key]
+            self.total_bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class TextStore:
+    """Document texts shared by all sessions, keyed by content hash and capped at max_chars in total.
+
+    Sessions keep only the hash, so a handout opened by a whole class is held once.
+    The most recently put text stays readable even if it is over max_chars or has
+    been evicted; any other evicted text reads back as None until it is put again.
+    """
+
+    def __init__(self, max_chars=50_000_000, max_entries=256):
+        self._texts = LRUCache(max_entries=max_entries, max_bytes=max_chars)
+        self._newest = (None, None)  # (key, text) of the last put, held outside the cap
+
+    def put(self, text):
+        """Store text and return its document_hash"""
+        key = document_hash(text)
+        # get() also marks the text as recently used, so documents in use are evicted last
+        if self._texts.get(key) is None:
+            self._texts.set(key, text)
+        self._newest = (key, text)
+        return key
+
+    def get(self, key):
+        if not key:
+            return None
+        text = self._texts.get(key)
+        if text is None:
+            newest_key, newest_text = self._newest
+            if newest_key == key:
+                return newest_text
+        return text
+
+    def stats(self):
+        return {"documents": len(self._texts), "chars": self._texts.total_bytes}
+
+
+class GenerationCache:
+    """Two-tier cache for generated questions: an LRU in memory backed by JSON files on disk"""
+
+    def __init__(self, cache_dir, max_entries=128, max_disk_entries=1000):
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.memory = LRUCache(max_entries)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """Return a copy of the cached questions for key, or None on a miss"""
+        questions = self.memory.get(key)
+        if questions is None:
+            questions = self._read_disk(key)
+            if questions is not None:
+                self.memory.set(key, questions)
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if questions is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [dict(q) for q in questions]
+
+    def set(self, key, questions):
+        questions = [dict(q) for q in questions]
+        self.memory.set(key, questions)
+        self._write_disk(key, questions)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+            }
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                questions = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Touch the file so disk pruning also follows recency of use
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return questions if isinstance(questions, list) else None
+
+    def _write_disk(self, key, questions):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(questions, f, ensure_ascii=False)
+            os.replace(tmp_path, path)  # Atomic so readers never see a partial file
+        except OSError:
+            return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        try:
+            entries = [
+                os.path.join(self.cache_dir, name)
+                for name in os.listdir(self.cache_dir)
+                if name.endswith(".json")
+            ]
+        except OSError:
+            return
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
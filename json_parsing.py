@@ -0,0 +1,197 @@
+import json
+import re
+import threading
+
+FENCE_PATTERN = re.compile(r"^\s*```[a-zA-Z]*[ \t]*\n?|\n?[ \t]*```\s*$")
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+# A value followed by a newline and the next key, with the comma between them missing
+MISSING_COMMA_PATTERN = re.compile(r'("|\d|true|false|null|[}\]])(\s*\n\s*)(?=")')
+
+
+def strip_code_fences(text):
+    """Remove a leading ```/```json fence and a trailing ``` fence in any spacing"""
+    return FENCE_PATTERN.sub("", text.strip())
+
+
+def repair_object(fragment):
+    """Try to load an object after fixing trailing and missing commas; None if still invalid"""
+    for candidate in (fragment, TRAILING_COMMA_PATTERN.sub(r"\1", fragment)):
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+    candidate = MISSING_COMMA_PATTERN.sub(r"\1,\2", TRAILING_COMMA_PATTERN.sub(r"\1", fragment))
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+
+
+class IncrementalObjectParser:
+    """Incrementally pull complete top-level JSON objects out of streamed model output.
+
+    Text outside objects (array brackets, commas, code fences, prose) is skipped,
+    so a response like '```json\\n[{...}, {...}]\\n```' yields each object as soon as
+    its closing brace arrives. Objects that fail to load are passed through
+    repair_object; finish() salvages an object left open by a truncated response
+    unless the cut fell inside one of required_fields.
+    """
+
+    def __init__(self, required_fields=()):
+        self.required_fields = frozenset(required_fields)
+        self._buffer = ""
+        self._pos = 0  # Next character of the buffer to scan
+        self._start = None  # Buffer index of the current object's opening brace
+        self._stack = []  # Open brackets inside the current object
+        self._in_string = False
+        self._escape = False
+        self.repaired = 0
+        self.dropped = 0
+
+    def _load(self, fragment):
+        try:
+            return json.loads(fragment)
+        except json.JSONDecodeError:
+            pass
+        obj = repair_object(fragment)
+        if obj is None:
+            self.dropped += 1
+        else:
+            self.repaired += 1
+        return obj
+
+    def feed(self, text):
+        """Consume a chunk of text and return the objects it completed"""
+        self._buffer += text
+        objects = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._start is None:
+                if char == "{":
+                    self._start = i
+                    self._stack = ["{"]
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+            elif char in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    obj = self._load(buffer[self._start:i + 1])
+                    if obj is not None:
+                        objects.append(obj)
+                    self._start = None
+            i += 1
+
+        # Drop everything already consumed so the buffer only holds the open object
+        keep_from = self._start if self._start is not None else len(buffer)
+        self._buffer = buffer[keep_from:]
+        self._pos = i - keep_from
+        if self._start is not None:
+            self._start = 0
+        return objects
+
+    def finish(self):
+        """Close any object left open at the end of the response and return it if it is still usable.
+
+        The field being written when the response was cut is incomplete, so the
+        object is dropped if that field is required rather than shown with its text
+        cut off. An object closed here counts as repaired, or dropped.
+        """
+        if self._start is None:
+            return []
+        fragment = self._buffer[self._start:].rstrip().rstrip(",")
+        cut_inside_value = self._in_string or len(self._stack) > 1
+        if self._in_string:
+            fragment += '"'
+        closers = {"{": "}", "[": "]"}
+        fragment += "".join(closers[c] for c in reversed(self._stack))
+        self._start = None
+        self._buffer = ""
+        self._pos = 0
+        obj = repair_object(fragment)
+        # Keys keep their order, so the last one is the field that was being written
+        if obj is None or (cut_inside_value and isinstance(obj, dict) and list(obj)[-1] in self.required_fields):
+            self.dropped += 1
+            return []
+        self.repaired += 1
+        return [obj]
+
+
+def recover_objects(text, required_fields=()):
+    """Return (objects, strict, repaired, dropped) for a full model response.
+
+    strict is True when the response loaded as-is; otherwise every well-formed
+    or repairable object is salvaged from the text, and a truncated last object
+    is kept only if the cut did not fall inside one of required_fields.
+    """
+    stripped = strip_code_fences(text)
+    try:
+        loaded = json.loads(stripped)
+        if isinstance(loaded, dict):
+            loaded = [loaded]
+        if isinstance(loaded, list):
+            return loaded, True, 0, 0
+    except json.JSONDecodeError:
+        pass
+    parser = IncrementalObjectParser(required_fields)
+    objects = parser.feed(stripped) + parser.finish()
+    return objects, False, parser.repaired, parser.dropped
+
+
+class RepairStats:
+    """Process-wide counters describing how often malformed responses were salvaged"""
+
+    def __init__(self):
+        self.responses = 0
+        self.strict = 0
+        self.salvaged = 0  # Malformed responses that still yielded questions
+        self.failed = 0  # Malformed responses with nothing recoverable
+        self.objects_repaired = 0
+        self.objects_dropped = 0
+        self.follow_up_calls = 0
+        self._lock = threading.Lock()
+
+    def record(self, strict, recovered, repaired=0, dropped=0):
+        with self._lock:
+            self.responses += 1
+            self.objects_repaired += repaired
+            self.objects_dropped += dropped
+            if strict:
+                self.strict += 1
+            elif recovered:
+                self.salvaged += 1
+            else:
+                self.failed += 1
+
+    def record_follow_up(self):
+        with self._lock:
+            self.follow_up_calls += 1
+
+    def snapshot(self):
+        with self._lock:
+            malformed = self.salvaged + self.failed
+            return {
+                "responses": self.responses,
+                "strict": self.strict,
+                "malformed": malformed,
+                "salvaged": self.salvaged,
+                "repair_success_rate": self.salvaged / malformed if malformed else 1.0,
+                "objects_repaired": self.objects_repaired,
+                "objects_dropped": self.objects_dropped,
+                "follow_up_calls": self.follow_up_calls,
+                # Each salvaged response would otherwise have been a full regeneration
+                "round_trips_saved": self.salvaged,
+            }
+
+
+repair_stats = RepairStats()
@@ -0,0 +1,137 @@
+import re
+from collections import Counter, deque
+
+from rate_limiter import CHARS_PER_TOKEN
+
+EDGE_LINES = 3  # Lines at the top and bottom of each page checked for running headers/footers
+MIN_REPEATS = 3  # Pages an edge line must appear on before it is treated as a header/footer
+LOOKAHEAD_PAGES = 4  # Pages held back so early pages can be judged against the ones after them
+MAX_HEADER_CHARS = 120
+
+# Words allowed around the numbers of a page-number line; PyPDF2 returns right-to-left lines reversed
+PAGE_WORDS = {"page", "p", "pg", "of", "صفحة", "الصفحة", "من", "ةحفص", "ةحفصلا", "نم"}
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+DIGIT_PATTERN = re.compile(r"[\d٠-٩]")
+# Running lines differ only by a page or chapter number at either end ("Unit 3", "Biology 101 ... 12")
+EDGE_NUMBER_PATTERN = re.compile(r"^[\d٠-٩]+|[\d٠-٩]+$")
+SPACE_PATTERN = re.compile(r"[ \t\f\v ]+")
+BLANK_LINES_PATTERN = re.compile(r"\n{3,}")
+# A word split across lines with a hyphen; only rejoined when the next line continues in lower case
+HYPHEN_BREAK_PATTERN = re.compile(r"([^\W\d_])-\n([^\W\d_])")
+
+
+def _is_page_number(line):
+    """True for lines like 12, - 12 -, Page 3 of 40 or صفحة 3 من 40"""
+    return bool(DIGIT_PATTERN.search(line)) and all(
+        word in PAGE_WORDS for word in WORD_PATTERN.findall(line.lower())
+    )
+
+
+def _edge_key(position, line):
+    """Compare header/footer candidates by position on the page, ignoring an edge number and case"""
+    return position, EDGE_NUMBER_PATTERN.sub("#", line.lower())
+
+
+class LayoutCleaner:
+    """Strip running headers, footers, page numbers and layout whitespace from PDF pages.
+
+    Pages are fed one at a time and come back LOOKAHEAD_PAGES later, once there
+    is enough context to tell a running header from ordinary text; finish()
+    returns the rest. Counts of what was removed accumulate across the document.
+    """
+
+    def __init__(self, min_repeats=MIN_REPEATS, lookahead=LOOKAHEAD_PAGES):
+        self.min_repeats = min_repeats
+        self.lookahead = lookahead
+        self._edge_counts = Counter()
+        self._pending = deque()  # (lines, edge keys) of pages not yet released
+        self._carry = ""  # Hyphenated word fragment ending the last released page
+        self.chars_in = 0
+        self.chars_out = 0
+        self.lines_removed = 0
+        self.hyphens_joined = 0
+
+    def _edges(self, lines):
+        """Map line index -> position (0, 1, ... from the top; -1, -2, ... from the bottom)"""
+        content = [i for i, line in enumerate(lines) if line]
+        edges = {i: -1 - n for n, i in enumerate(reversed(content[-EDGE_LINES:]))}
+        edges.update({i: n for n, i in enumerate(content[:EDGE_LINES])})
+        return edges
+
+    def feed(self, page_text):
+        """Add the next page; returns the cleaned pages that are now ready, possibly none"""
+        self.chars_in += len(page_text)
+        lines = [SPACE_PATTERN.sub(" ", line).strip() for line in page_text.splitlines()]
+        keys = {}
+        for i, position in self._edges(lines).items():
+            if len(lines[i]) <= MAX_HEADER_CHARS:
+                keys[i] = _edge_key(position, lines[i])
+        self._edge_counts.update(set(keys.values()))
+        self._pending.append((lines, keys))
+        ready = []
+        while len(self._pending) > self.lookahead:
+            ready.append(self._release(*self._pending.popleft()))
+        return ready
+
+    def finish(self):
+        """Release every page still held back"""
+        ready = [self._release(*self._pending.popleft()) for _ in range(len(self._pending))]
+        if self._carry:
+            # A trailing hyphen with no following page stays as it was
+            if ready:
+                ready[-1] += self._carry
+            else:
+                ready.append(self._carry)
+            self.chars_out += len(self._carry)
+            self._carry = ""
+        return ready
+
+    def clean_pages(self, pages):
+        """Generator form: yield cleaned pages from an iterable of raw page texts"""
+        for page_text in pages:
+            yield from self.feed(page_text)
+        yield from self.finish()
+
+    def _release(self, lines, keys):
+        kept = []
+        for i, line in enumerate(lines):
+            if i in keys and (_is_page_number(line) or self._edge_counts[keys[i]] >= self.min_repeats):
+                self.lines_removed += 1
+                continue
+            kept.append(line)
+        text = BLANK_LINES_PATTERN.sub("\n\n", "\n".join(kept).strip("\n"))
+        text = HYPHEN_BREAK_PATTERN.sub(self._join_hyphen, text)
+        if self._carry:
+            text = self._join_across(text)
+        if text.endswith("-") and len(text) > 1 and text[-2].isalpha():
+            # Hold the fragment back in case the next page continues the word
+            cut = max(text.rfind(" "), text.rfind("\n")) + 1
+            text, self._carry = text[:cut], text[cut:]
+        else:
+            self._carry = ""
+        self.chars_out += len(text)
+        return text
+
+    def _join_hyphen(self, match):
+        if not match.group(2).islower():
+            return match.group(0)
+        self.hyphens_joined += 1
+        return match.group(1) + match.group(2)
+
+    def _join_across(self, text):
+        if text[:1].islower():
+            self.hyphens_joined += 1
+            return self._carry[:-1] + text
+        return self._carry + "\n" + text if text else self._carry
+
+    def stats(self):
+        chars_saved = max(0, self.chars_in - self.chars_out)
+        return {
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+            "chars_saved": chars_saved,
+            "tokens_saved": chars_saved // CHARS_PER_TOKEN,
+            "saved_pct": round(100 * chars_saved / self.chars_in, 2) if self.chars_in else 0.0,
+            "lines_removed": self.lines_removed,
+            "hyphens_joined": self.hyphens_joined,
+        }
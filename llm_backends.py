@@ -0,0 +1,204 @@
+import hashlib
+import importlib.util
+import json
+import random
+import re
+import threading
+import time
+
+from metrics import record_usage
+from rate_limiter import CHARS_PER_TOKEN
+
+
+class BackendError(Exception):
+    """Error raised by a backend; code=429 marks it as rate limited"""
+
+    def __init__(self, message, code=None, retry_after=None):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+
+
+class LLMBackend:
+    """Minimal text-in/text-out interface every model provider implements"""
+
+    name = "base"
+    model_name = ""
+
+    def generate(self, prompt):
+        """Return the full response text for prompt"""
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """Yield the response text in pieces; defaults to a single piece"""
+        yield self.generate(prompt)
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key, model_name="gemini-1.5-flash"):
+        # The SDK is the slowest import in the app, so it is only checked for here and loaded on first use
+        if importlib.util.find_spec("google.generativeai") is None:
+            raise ImportError("google-generativeai is not installed")
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def _record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record_usage(self.name, usage.prompt_token_count, usage.candidates_token_count)
+
+    def generate(self, prompt):
+        response = self.model.generate_content(prompt)
+        self._record_usage(response)
+        return response.text
+
+    def stream(self, prompt):
+        part = None
+        for part in self.model.generate_content(prompt, stream=True):
+            yield part.text
+        # Usage metadata on the last part covers the whole response
+        if part is not None:
+            self._record_usage(part)
+
+
+class OpenAIBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, model_name="gpt-3.5-turbo", temperature=0.7):
+        import openai
+        self.openai = openai
+        self.model_name = model_name
+        self.temperature = temperature
+
+    def generate(self, prompt):
+        response = self.openai.ChatCompletion.create(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=self.temperature
+        )
+        usage = response.get("usage")
+        if usage:
+            record_usage(self.name, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        return response.choices[0].message.content
+
+    def stream(self, prompt):
+        response = self.openai.ChatCompletion.create(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=self.temperature,
+            stream=True
+        )
+        for part in response:
+            text = part.choices[0].delta.get("content")
+            if text:
+                yield text
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic offline stand-in for benchmarks and CI.
+
+    Reads the requested easy/mid/hard counts from the prompt's requirement lines
+    and answers with well-formed questions after `latency` seconds. failure_rate
+    and rate_limit_rate inject generic errors and 429s respectively; invalid_rate
+    is the share of questions returned without an explanation, which validation rejects.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, rate_limit_rate=0.0, invalid_rate=0.0,
+                 retry_after=1.0, stream_pieces=8, seed=0, model_name="fake-model"):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.invalid_rate = invalid_rate
+        self.retry_after = retry_after
+        self.stream_pieces = stream_pieces
+        self.model_name = model_name
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            self.calls += 1
+            return self._random.random(), self._random.uniform(-self.jitter, self.jitter)
+
+    def _check_failures(self, roll):
+        if roll < self.rate_limit_rate:
+            raise BackendError(
+                f"429 Resource has been exhausted (retry in {self.retry_after}s)",
+                code=429,
+                retry_after=self.retry_after
+            )
+        if roll < self.rate_limit_rate + self.failure_rate:
+            raise BackendError("500 Injected backend failure", code=500)
+
+    def render(self, prompt):
+        """The response this backend gives for prompt, without latency or failures"""
+        counts = [int(n) for n in re.findall(r"^- (\d+) ", prompt, re.MULTILINE)[:3]]
+        counts += [0] * (3 - len(counts))
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        questions = []
+        for difficulty, count in zip(("easy", "mid", "hard"), counts):
+            for i in range(count):
+                tag = f"{digest[:8]}-{difficulty}-{i}"
+                questions.append({
+                    "question": f"Question {tag}: which option is correct?",
+                    "options": [f"Option {tag} {letter}" for letter in "ABCD"],
+                    "correct": "ABCD"[int(digest[i % len(digest)], 16) % 4],
+                    "difficulty": difficulty,
+                    "explanation": f"Explanation for {tag}."
+                })
+        if self.invalid_rate:
+            with self._lock:
+                for q in questions:
+                    if self._random.random() < self.invalid_rate:
+                        del q["explanation"]
+        return json.dumps(questions, ensure_ascii=False, indent=2)
+
+    def _record_usage(self, prompt, text):
+        # Stands in for provider usage metadata so offline runs exercise the token metrics
+        record_usage(self.name, len(prompt) // CHARS_PER_TOKEN, len(text) // CHARS_PER_TOKEN)
+
+    def generate(self, prompt):
+        roll, jitter = self._roll()
+        time.sleep(max(0.0, self.latency + jitter))
+        self._check_failures(roll)
+        text = self.render(prompt)
+        self._record_usage(prompt, text)
+        return text
+
+    def stream(self, prompt):
+        roll, jitter = self._roll()
+        self._check_failures(roll)
+        text = self.render(prompt)
+        pieces = max(1, self.stream_pieces)
+        size = -(-len(text) // pieces)  # Ceiling division
+        delay = max(0.0, self.latency + jitter) / pieces
+        for start in range(0, len(text), size):
+            time.sleep(delay)
+            yield text[start:start + size]
+        self._record_usage(prompt, text)
+
+
+def create_backend(name, **kwargs):
+    """Build a backend by name: 'gemini', 'openai' or 'fake'"""
+    backends = {"gemini": GeminiBackend, "openai": OpenAIBackend, "fake": FakeBackend}
+    if name not in backends:
+        raise ValueError(f"Unknown LLM backend: {name}")
+    return backends[name](**kwargs)
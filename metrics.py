@@ -0,0 +1,183 @@
+"""Process-wide counters and latency/size histograms, exported as JSON or Prometheus text.
+
+Every observation is also logged as one JSON line on the "quiz.metrics" logger,
+so the same events can be shipped as structured logs.
+"""
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PREFIX = "quiz_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+RECENT_SAMPLES = 1024  # Observations kept per histogram for percentiles in the JSON snapshot
+
+logger = logging.getLogger("quiz.metrics")
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(pct / 100 * len(sorted_values)))]
+
+
+class Histogram:
+    """Cumulative-bucket histogram plus a window of recent values for percentiles"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def summary(self):
+        values = sorted(self.recent)
+        result = {"count": self.count, "sum": self.sum}
+        if values:
+            result.update(p50=_percentile(values, 50), p95=_percentile(values, 95),
+                          p99=_percentile(values, 99), max=values[-1])
+        return result
+
+
+class MetricsRegistry:
+    """Thread-safe named counters and histograms with optional labels.
+
+    Names ending in _seconds get latency buckets, others size buckets. Collectors
+    registered with add_collector contribute gauges computed at export time, for
+    components that already keep their own counters (rate limiter, caches).
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                buckets = LATENCY_BUCKETS if name.endswith("_seconds") else SIZE_BUCKETS
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({"metric": name, "value": value, **labels}, ensure_ascii=False))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds spent in the with block, whether or not it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, prefix, collect):
+        """collect() returns a flat dict of numbers, exported as gauges named prefix_key"""
+        with self._lock:
+            self._collectors[prefix] = collect
+
+    def _gauges(self):
+        gauges = {}
+        for prefix, collect in list(self._collectors.items()):
+            try:
+                values = collect()
+            except Exception:
+                continue  # A broken collector must not take the export down with it
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{prefix}_{key}"] = value
+        return gauges
+
+    def snapshot(self):
+        """JSON-serialisable view with p50/p95/p99 over recent observations"""
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), **histogram.summary()}
+                          for (name, labels), histogram in sorted(self._histograms.items())]
+        return {"counters": counters, "histograms": histograms, "gauges": self._gauges()}
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{PREFIX}{name}_total{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, value in sorted(self._gauges().items()):
+            lines.append(f"{PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically write the metrics to path: Prometheus text for .prom, JSON otherwise"""
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def write_every(self, path, interval):
+        """write(path) at most once per interval seconds; returns True if it wrote"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_write < interval:
+                return False
+            self._last_write = now
+        self.write(path)
+        return True
+
+
+def record_usage(backend, prompt_tokens=None, response_tokens=None):
+    """Token counts reported by a model response's usage metadata"""
+    if prompt_tokens is not None:
+        metrics.increment("prompt_tokens", prompt_tokens, backend=backend)
+    if response_tokens is not None:
+        metrics.increment("response_tokens", response_tokens, backend=backend)
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,203 @@
+import hashlib
+import math
+import random
+import re
+from collections import Counter
+
+from caching import LRUCache
+from passage_index import SENTENCE_BREAK, TOKEN_PATTERN, get_passage_index
+from question_bank import document_hash
+from question_pipeline import normalize_question, rebalance_questions, validate_question
+
+CONTEXT_CHARS = 60_000  # Informative passages scanned for sentences, so very long documents stay fast
+MIN_SENTENCE_CHARS = 40
+MAX_SENTENCE_CHARS = 300
+MIN_TERM_CHARS = 4
+COMMON_TERM_SENTENCES = 3  # Terms in at least this many sentences make mid cloze questions, rarer ones hard
+BLANK = "_____"
+
+STOPWORDS = frozenset("""
+about above after again against also although among another because been before being below between both
+certain could does doing down during each either every from further gave give given gives have having here
+however into itself just made make makes many might more most much must neither often only other otherwise
+over part same several shall should since some such take than that their theirs them themselves then there
+therefore these they this those through thus under until upon used uses using very were what when where
+whether which while whom whose will with within without would your yours
+في من على إلى الى عن أن إن أو ثم قد لا ما كل بين بعد قبل حيث عند مع كما التي التى الذي الذين هذا هذه
+ذلك تلك هناك هنا كان كانت يكون تكون وهو وهي هو هي هم لكن ولكن أيضا أيضاً غير بها به له لها فيها فيه
+منها منه عليه عليها إلا حتى لدى خلال ضمن نحو عندما بينما كذلك ليس ليست لقد وقد وفي ومن وعلى وإلى
+""".split())
+
+# "X is/are ..." and "X refers to ..." openings; Arabic "X هو/هي ..." and "يُعرف X بأنه ..."
+DEFINITION_PATTERNS = {
+    "en": re.compile(r"^(?:The |An |A )?([A-Za-z][\w\- ]{2,40}?) (?:is|are|refers to|means) (?:an? |the )?(.{15,})$"),
+    "ar": re.compile(r"^(?:يُ?عرَّ?ف )?(\S+(?: \S+){0,3}?) (?:هو|هي|هم|بأنه|بأنها) (.{15,})$"),
+}
+
+TEMPLATES = {
+    "en": {
+        "cloze": "Fill in the blank: {sentence}",
+        "definition": "Which term is described as: \"{definition}\"?",
+        "explanation": "The document says: \"{sentence}\"",
+    },
+    "ar": {
+        "cloze": "أكمل الفراغ: {sentence}",
+        "definition": "أي مصطلح يوصف بأنه: «{definition}»؟",
+        "explanation": "ورد في النص: «{sentence}»",
+    },
+}
+
+
+def _sentences(text):
+    for sentence in SENTENCE_BREAK.split(text):
+        sentence = " ".join(sentence.split())
+        if MIN_SENTENCE_CHARS <= len(sentence) <= MAX_SENTENCE_CHARS:
+            letters = sum(c.isalpha() for c in sentence)
+            # Skip tables, references, links and other lines that are mostly numbers or symbols
+            if letters >= 0.7 * (len(sentence) - sentence.count(" ")) and "://" not in sentence:
+                yield sentence
+
+
+def _is_term(token):
+    return len(token) >= MIN_TERM_CHARS and not token.isdigit() and token not in STOPWORDS
+
+
+class OfflineQuestionGenerator:
+    """Cloze and term-definition questions built from one document without a model.
+
+    Key terms are scored TF-IDF style over the document's sentences: a term that
+    recurs in a few sentences is more central than one that appears once or in
+    nearly all of them, and longer terms are favoured over short common words. Cloze questions blank the highest-scoring term of a
+    sentence; definition questions come from "X is ..." sentences. Distractors
+    are other key terms of similar length, so options look alike. Output is
+    deterministic for a given document.
+    """
+
+    def __init__(self, text, language="en"):
+        self.language = language if language in TEMPLATES else "en"
+        context = "\n\n".join(get_passage_index(text).select(CONTEXT_CHARS))
+        self.sentences = list(dict.fromkeys(_sentences(context)))
+        self._seed = document_hash(text)
+
+        sentence_terms = []
+        surface = {}
+        for sentence in self.sentences:
+            words = TOKEN_PATTERN.findall(sentence)
+            for word in words:
+                surface.setdefault(word.lower(), Counter())[word] += 1
+            sentence_terms.append({w.lower() for w in words if _is_term(w.lower())})
+        frequency = Counter(term for terms in sentence_terms for term in terms)
+        n = max(1, len(self.sentences))
+        # Longer words tend to be the subject-specific ones worth asking about
+        self.scores = {
+            term: math.log(1 + count) * math.log(1 + n / count) * math.sqrt(len(term))
+            for term, count in frequency.items() if count < max(2, n // 2)
+        }
+        self.frequency = frequency
+        # Display each term the way the document usually writes it
+        self.display = {term: surface[term].most_common(1)[0][0] for term in self.scores}
+        self.vocabulary = sorted(self.scores, key=lambda term: (-self.scores[term], term))[:500]
+        self.candidates = self._definition_candidates() + self._cloze_candidates(sentence_terms)
+
+    def _rng(self, *parts):
+        return random.Random(hashlib.sha256("|".join((self._seed,) + parts).encode("utf-8")).hexdigest())
+
+    def _distractors(self, answer, exclude, rng, count=3):
+        """Other key terms of similar length, skipping any already in the question"""
+        answer_key = answer.lower()
+        pool = [
+            term for term in self.vocabulary
+            if term != answer_key and term not in exclude and 0.5 <= len(term) / len(answer_key) <= 2
+        ][:60]
+        if len(pool) < count:
+            return None
+        return [self.display[term] for term in rng.sample(pool, count)]
+
+    def _question(self, text, answer, difficulty, sentence, exclude):
+        rng = self._rng(text)
+        distractors = self._distractors(answer, exclude, rng)
+        if distractors is None:
+            return None
+        options = distractors + [answer]
+        rng.shuffle(options)
+        return {
+            "question": text,
+            "options": options,
+            "correct": chr(65 + options.index(answer)),
+            "difficulty": difficulty,
+            "explanation": TEMPLATES[self.language]["explanation"].format(sentence=sentence),
+        }
+
+    def _definition_candidates(self):
+        pattern = DEFINITION_PATTERNS.get(self.language, DEFINITION_PATTERNS["en"])
+        candidates = []
+        for position, sentence in enumerate(self.sentences):
+            match = pattern.match(sentence)
+            if not match:
+                continue
+            term, definition = match.group(1).strip(), match.group(2).strip().rstrip(".؟?!")
+            key = term.lower()
+            # Only terms the document keeps coming back to, so the question is about a real concept
+            if key not in self.scores or term.lower() in definition.lower():
+                continue
+            text = TEMPLATES[self.language]["definition"].format(definition=definition)
+            question = self._question(text, self.display[key], "easy", sentence, {key})
+            if question:
+                candidates.append((self.scores[key], key, position, question))
+        return candidates
+
+    def _cloze_candidates(self, sentence_terms):
+        candidates = []
+        for position, (sentence, terms) in enumerate(zip(self.sentences, sentence_terms)):
+            scored = [term for term in terms if term in self.scores]
+            if not scored:
+                continue
+            term = max(scored, key=lambda t: (self.scores[t], t))
+            blanked = re.sub(rf"(?<!\w){re.escape(term)}(?!\w)", BLANK, sentence, count=1, flags=re.IGNORECASE)
+            if BLANK not in blanked:
+                continue
+            difficulty = "mid" if self.frequency[term] >= COMMON_TERM_SENTENCES else "hard"
+            text = TEMPLATES[self.language]["cloze"].format(sentence=blanked)
+            question = self._question(text, self.display[term], difficulty, sentence, terms)
+            if question:
+                candidates.append((self.scores[term], term, position, question))
+        return candidates
+
+    def questions(self, num_easy, num_mid, num_hard, avoid=()):
+        """Up to the requested mix, each key term asked about at most once, in document order"""
+        avoid_keys = {normalize_question(question) for question in avoid}
+        wanted = {"easy": num_easy, "mid": num_mid, "hard": num_hard}
+        total = num_easy + num_mid + num_hard
+        ranked = [
+            (term, position, question)
+            for _, term, position, question in sorted(self.candidates, key=lambda c: (-c[0], c[2]))
+            if normalize_question(question["question"]) not in avoid_keys
+        ]
+        picked = []
+        used_terms = set()
+        # Fill each level with its best questions, then top up a short level from the others
+        for fill in (True, False):
+            for term, position, question in ranked:
+                if len(picked) >= total:
+                    break
+                if term in used_terms or (fill and wanted[question["difficulty"]] <= 0):
+                    continue
+                wanted[question["difficulty"]] -= 1
+                used_terms.add(term)
+                picked.append((position, question))
+        picked.sort(key=lambda item: item[0])
+        questions = [validate_question(dict(q, options=list(q["options"]))) for _, q in picked]
+        return rebalance_questions([q for q in questions if q], num_easy, num_mid, num_hard)
+
+
+_generator_cache = LRUCache(max_entries=16)
+
+
+def generate_offline(text, num_easy, num_mid, num_hard, language="en", avoid=()):
+    """A quiz built locally from text in the same format as validated model questions; may be short"""
+    key = (document_hash(text), language)
+    generator = _generator_cache.get(key)
+    if generator is None:
+        generator = OfflineQuestionGenerator(text, language)
+        _generator_cache.set(key, generator)
+    return generator.questions(num_easy, num_mid, num_hard, avoid)
@@ -0,0 +1,149 @@
+import threading
+
+from question_pipeline import DIFFICULTIES, normalize_question
+
+BATCH_SIZE = 3  # Questions generated per page
+LOOKAHEAD = 2  # Fetch the next page once this few generated questions are left unanswered
+ADAPT_STEP = 0.5  # Share of a level's weight moved up or down per adjustment
+MASTERED = 0.8  # Accuracy at a level above which questions move to the next harder one
+STRUGGLING = 0.5  # Accuracy below which they move to the next easier one
+
+
+def difficulty_results(questions, answers):
+    """Map difficulty -> (correct, answered) for the questions answered so far; answers is an AnswerLog"""
+    results = {difficulty: (0, 0) for difficulty in DIFFICULTIES}
+    for answer in answers:
+        if answer.question_index >= len(questions):
+            continue
+        difficulty = questions[answer.question_index].get("difficulty")
+        if difficulty in results:
+            correct, answered = results[difficulty]
+            results[difficulty] = (correct + answer.is_correct, answered + 1)
+    return results
+
+
+def adaptive_counts(batch_size, easy_pct, mid_pct, results=None):
+    """Difficulty counts for the next page: the slider mix, shifted by running correctness.
+
+    A level the user answers well (at least MASTERED) hands part of its weight
+    to the next harder level; a level they struggle with (below STRUGGLING)
+    hands part to the next easier one.
+    """
+    weights = [easy_pct, mid_pct, max(0, 100 - easy_pct - mid_pct)]
+    if not sum(weights):
+        weights = [1, 1, 1]
+    for i, difficulty in enumerate(DIFFICULTIES):
+        correct, answered = (results or {}).get(difficulty, (0, 0))
+        if not answered:
+            continue
+        accuracy = correct / answered
+        target = i + 1 if accuracy >= MASTERED else i - 1 if accuracy < STRUGGLING else None
+        if target is not None and 0 <= target < len(weights):
+            moved = weights[i] * ADAPT_STEP
+            weights[i] -= moved
+            weights[target] += moved
+    # Largest-remainder apportionment so the counts always add up to batch_size
+    total = sum(weights)
+    shares = [batch_size * w / total for w in weights]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(3), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:batch_size - sum(counts)]:
+        counts[i] += 1
+    return tuple(counts)
+
+
+class QuizCancelled(Exception):
+    """Raised inside a page producer once the quiz has been reset or replaced"""
+
+
+class PagedQuiz:
+    """A quiz generated a page at a time, just ahead of the user.
+
+    Exposes the same questions/wait_for/expected_total/done/cancel interface as
+    QuestionStream, so the quiz loop can wait on it the same way.
+    generate_page(num_easy, num_mid, num_hard, asked) must return validated
+    questions and runs in a background thread for every page but the first.
+    """
+
+    def __init__(self, total, easy_pct, mid_pct, generate_page, batch_size=BATCH_SIZE, lookahead=LOOKAHEAD):
+        self.total = total
+        self.easy_pct = easy_pct
+        self.mid_pct = mid_pct
+        self.generate_page = generate_page
+        self.batch_size = batch_size
+        self.lookahead = lookahead
+        self.questions = []
+        self.errors = []
+        self.pages = []  # (num_easy, num_mid, num_hard) requested for each page, for inspection
+        self.done = False
+        self.cancelled = False
+        self._fetching = False
+        self._cond = threading.Condition()
+
+    def _next_counts(self, results):
+        size = min(self.batch_size, self.total - len(self.questions))
+        return adaptive_counts(size, self.easy_pct, self.mid_pct, results)
+
+    def _fetch(self, counts):
+        asked = [q["question"] for q in self.questions]
+        try:
+            page = self.generate_page(*counts, asked) or []
+            error = None
+        except Exception as e:
+            page, error = [], e
+        with self._cond:
+            seen = {normalize_question(q["question"]) for q in self.questions}
+            added = 0
+            for q in page:
+                key = normalize_question(q["question"])
+                if key not in seen and len(self.questions) < self.total and not self.cancelled:
+                    seen.add(key)
+                    self.questions.append(q)
+                    added += 1
+            if error is not None:
+                self.errors.append(error)
+            # A page that adds nothing ends the quiz rather than retrying forever
+            if not added or len(self.questions) >= self.total:
+                self.done = True
+            self._fetching = False
+            self._cond.notify_all()
+
+    def start(self):
+        """Generate the first page in the calling thread; returns the questions so far"""
+        counts = self._next_counts(None)
+        with self._cond:
+            self._fetching = True
+        self.pages.append(counts)
+        self._fetch(counts)
+        return self.questions
+
+    def advance(self, current_index, results):
+        """Start the next page in the background if the user is close to the end of what exists"""
+        with self._cond:
+            if self.done or self._fetching or len(self.questions) - current_index > self.lookahead:
+                return False
+            self._fetching = True
+            counts = self._next_counts(results)
+        self.pages.append(counts)
+        threading.Thread(target=self._fetch, args=(counts,), daemon=True).start()
+        return True
+
+    def check(self):
+        """Call before each model call of a page so a cancelled quiz stops spending"""
+        if self.cancelled:
+            raise QuizCancelled()
+
+    def cancel(self):
+        with self._cond:
+            self.cancelled = True
+            self.done = True
+            self._cond.notify_all()
+
+    def wait_for(self, count, timeout=None):
+        """Block until at least count questions exist or no more are coming"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.questions) >= count or self.done, timeout)
+            return len(self.questions) >= count
+
+    def expected_total(self):
+        return len(self.questions) if self.done else self.total
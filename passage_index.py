@@ -0,0 +1,136 @@
+import re
+
+import numpy as np
+
+from caching import LRUCache
+from question_bank import document_hash
+
+PASSAGE_CHARS = 800
+MMR_LAMBDA = 0.7  # Weight of informativeness against redundancy with passages already picked
+TOKEN_PATTERN = re.compile(r"\w{2,}")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?؟])\s+|\n\s*\n")
+
+
+def _pieces(text, passage_chars):
+    """Sentences and paragraphs of text, with run-on pieces cut at spaces to passage_chars"""
+    for piece in SENTENCE_BREAK.split(text):
+        piece = piece.strip()
+        while len(piece) > passage_chars:
+            cut = piece.rfind(" ", 0, passage_chars)
+            if cut <= 0:
+                cut = passage_chars
+            yield piece[:cut]
+            piece = piece[cut:].strip()
+        if piece:
+            yield piece
+
+
+def split_passages(text, passage_chars=PASSAGE_CHARS):
+    """Split text into passages of at most passage_chars, on paragraph and sentence breaks"""
+    passages = []
+    current = []
+    length = 0
+    for piece in _pieces(text, passage_chars):
+        if current and length + len(piece) > passage_chars:
+            passages.append(" ".join(current))
+            current, length = [], 0
+        current.append(piece)
+        length += len(piece) + 1
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class PassageIndex:
+    """BM25-weighted term index over one document's passages.
+
+    Term weights are stored sparsely as parallel (row, column, weight) arrays so a
+    500-page document stays small. Passages are scored by how much of the
+    document's salient vocabulary they carry, scaled by how much of them is
+    prose (tables of contents and page furniture score low).
+    """
+
+    def __init__(self, text, passage_chars=PASSAGE_CHARS, k1=1.5, b=0.75):
+        self.passages = split_passages(text, passage_chars)
+        vocabulary = {}
+        rows, cols = [], []
+        prose = []
+        for row, passage in enumerate(self.passages):
+            tokens = TOKEN_PATTERN.findall(passage.lower())
+            for token in tokens:
+                rows.append(row)
+                cols.append(vocabulary.setdefault(token, len(vocabulary)))
+            letters = sum(c.isalpha() for c in passage)
+            prose.append(letters / max(1, len(passage) - passage.count(" ")))
+
+        n = len(self.passages)
+        self.lengths = np.array([len(p) for p in self.passages], dtype=np.int64)
+        if not rows:
+            self.scores = np.zeros(n)
+            self._rows = self._cols = np.zeros(0, dtype=np.int64)
+            self._weights = np.zeros(0)
+            return
+
+        # Collapse repeated (row, term) pairs into term frequencies
+        pairs = np.array(rows, dtype=np.int64) * len(vocabulary) + np.array(cols, dtype=np.int64)
+        unique_pairs, tf = np.unique(pairs, return_counts=True)
+        self._rows = unique_pairs // len(vocabulary)
+        self._cols = unique_pairs % len(vocabulary)
+
+        doc_freq = np.bincount(self._cols, minlength=len(vocabulary))
+        idf = np.log(1 + (n - doc_freq + 0.5) / (doc_freq + 0.5))
+        passage_tokens = np.bincount(self._rows, weights=tf, minlength=n)
+        length_norm = 1 - b + b * passage_tokens / max(passage_tokens.mean(), 1)
+        self._weights = idf[self._cols] * tf * (k1 + 1) / (tf + k1 * length_norm[self._rows])
+
+        # Salient terms recur across the document without being everywhere
+        salience = idf * np.minimum(doc_freq, np.sqrt(n)) / n
+        informativeness = np.bincount(self._rows, weights=self._weights * salience[self._cols], minlength=n)
+        self.scores = informativeness * np.array(prose) ** 2
+        norms = np.sqrt(np.bincount(self._rows, weights=self._weights ** 2, minlength=n))
+        self._weights = self._weights / np.maximum(norms[self._rows], 1e-12)
+        self._vocabulary_size = len(vocabulary)
+
+    def _similarity_to(self, row):
+        """Cosine similarity of every passage to passage row"""
+        vector = np.zeros(self._vocabulary_size)
+        mask = self._rows == row
+        vector[self._cols[mask]] = self._weights[mask]
+        return np.bincount(self._rows, weights=self._weights * vector[self._cols], minlength=len(self.passages))
+
+    def select(self, char_budget, mmr_lambda=MMR_LAMBDA):
+        """Pick informative, mutually diverse passages within char_budget; returned in document order"""
+        if not self.passages:
+            return []
+        if self.lengths.sum() <= char_budget:
+            return list(self.passages)
+        relevance = self.scores / max(self.scores.max(), 1e-12)
+        redundancy = np.zeros(len(self.passages))
+        available = np.ones(len(self.passages), dtype=bool)
+        chosen = []
+        remaining = char_budget
+        while True:
+            available &= self.lengths <= remaining
+            if not available.any():
+                break
+            gain = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+            row = int(np.argmax(gain))
+            chosen.append(row)
+            available[row] = False
+            remaining -= self.lengths[row]
+            if self._rows.size:
+                redundancy = np.maximum(redundancy, self._similarity_to(row))
+        return [self.passages[row] for row in sorted(chosen)]
+
+
+_index_cache = LRUCache(max_entries=16)
+
+
+def get_passage_index(text):
+    """Build the index for text once and reuse it for later generations"""
+    key = document_hash(text)
+    index = _index_cache.get(key)
+    if index is None:
+        index = PassageIndex(text)
+        _index_cache.set(key, index)
+    return index
@@ -0,0 +1,130 @@
+import json
+import threading
+
+from caching import LRUCache
+
+
+class PrefetchCancelled(Exception):
+    """Raised inside a producer to abandon a prefetch that is no longer wanted"""
+
+
+class PrefetchJob:
+    """One background generation of a session's next quiz"""
+
+    def __init__(self, key):
+        self.key = key
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+
+    def check(self):
+        """Call between expensive steps of a producer to stop promptly after cancel()"""
+        if self.cancelled.is_set():
+            raise PrefetchCancelled()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class Prefetcher:
+    """Prepares each session's next quiz in the background, one job per session.
+
+    A job is identified by a key covering the document and quiz settings; starting
+    a job with a different key cancels the old one. Finished quizzes are held in
+    an LRU cache capped at max_bytes of JSON across all sessions, so an abandoned
+    session's quiz is evicted before it can crowd out active ones.
+    """
+
+    def __init__(self, max_bytes=5_000_000, max_entries=256):
+        self._results = LRUCache(
+            max_entries=max_entries, max_bytes=max_bytes,
+            sizeof=lambda entry: len(json.dumps(entry[1], ensure_ascii=False))
+        )
+        self._jobs = {}  # session_id -> PrefetchJob, oldest first
+        self.max_jobs = max_entries
+        self._lock = threading.Lock()
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def start(self, session_id, key, produce):
+        """Run produce(job) -> quiz in the background unless this key is already running or ready"""
+        with self._lock:
+            job = self._jobs.get(session_id)
+            # A failed or evicted job is not retried for the same key; the quiz is just generated on demand
+            if job is not None and job.key == key and not job.cancelled.is_set():
+                return job
+            if job is not None:
+                self._cancel(job)
+            self._results.pop(session_id)
+            self._jobs.pop(session_id, None)
+            self._prune()
+            job = self._jobs[session_id] = PrefetchJob(key)
+            self.started += 1
+        threading.Thread(target=self._run, args=(session_id, job, produce), daemon=True).start()
+        return job
+
+    def _run(self, session_id, job, produce):
+        try:
+            quiz = produce(job)
+            with self._lock:
+                # Only publish if this job is still the session's current one
+                if quiz and self._jobs.get(session_id) is job and not job.cancelled.is_set():
+                    self._results.set(session_id, (job.key, quiz))
+        except PrefetchCancelled:
+            pass
+        except Exception as e:
+            job.error = e
+            with self._lock:
+                self.failed += 1
+        finally:
+            job.done.set()
+
+    def take(self, session_id, key, timeout=None):
+        """The prefetched quiz for key, waiting up to timeout for a running job; None if unavailable"""
+        with self._lock:
+            job = self._jobs.get(session_id)
+        if job is None or job.key != key:
+            return None
+        job.done.wait(timeout)
+        with self._lock:
+            entry = self._results.get(session_id)
+            if self._jobs.get(session_id) is not job or not entry or entry[0] != key:
+                return None
+            del self._jobs[session_id]
+            self._results.pop(session_id)
+            self.used += 1
+            return entry[1]
+
+    def cancel(self, session_id):
+        with self._lock:
+            job = self._jobs.pop(session_id, None)
+            if job is not None:
+                self._cancel(job)
+            self._results.pop(session_id)
+
+    def _prune(self):
+        """Forget the oldest finished jobs whose quiz is gone, so abandoned sessions do not accumulate"""
+        for session_id in list(self._jobs):
+            if len(self._jobs) < self.max_jobs:
+                break
+            if self._jobs[session_id].done.is_set() and session_id not in self._results:
+                del self._jobs[session_id]
+
+    def _cancel(self, job):
+        if not job.done.is_set():
+            self.cancelled += 1
+        job.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": sum(not job.done.is_set() for job in self._jobs.values()),
+                "ready": len(self._results),
+                "bytes": self._results.total_bytes,
+                "started": self.started,
+                "used": self.used,
+                "cancelled": self.cancelled,
+                "failed": self.failed,
+            }
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from question_pipeline import DIFFICULTIES, normalize_question
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    doc_hash TEXT NOT NULL,
+    language TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    question TEXT NOT NULL,
+    options TEXT NOT NULL,
+    correct TEXT NOT NULL,
+    explanation TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    UNIQUE (doc_hash, language, dedupe_key)
+);
+CREATE INDEX IF NOT EXISTS questions_by_document ON questions (doc_hash, language, difficulty);
+"""
+
+# External-content FTS5 table kept in sync by triggers; skipped when SQLite lacks FTS5
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+    question, explanation, content='questions', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+    INSERT INTO questions_fts (rowid, question, explanation) VALUES (new.id, new.question, new.explanation);
+END;
+CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+    INSERT INTO questions_fts (questions_fts, rowid, question, explanation)
+    VALUES ('delete', old.id, old.question, old.explanation);
+END;
+"""
+
+COLUMNS = "q.id, q.doc_hash, q.question, q.options, q.correct, q.difficulty, q.explanation"
+
+
+def document_hash(text):
+    """Identify a source document by its extracted text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class QuestionBank:
+    """Validated questions persisted in SQLite, keyed by source document hash and language.
+
+    One connection is shared across threads behind a lock; writes are small and
+    infrequent, and reads are indexed lookups that take well under a millisecond.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            try:
+                self._conn.executescript(FTS_SCHEMA)
+                self.full_text = True
+            except sqlite3.OperationalError:
+                self.full_text = False
+
+    def add_questions(self, doc_hash, language, questions):
+        """Store validated questions, ignoring ones already banked for this document; returns the number added"""
+        now = time.time()
+        rows = [
+            (doc_hash, language, q["difficulty"], q["question"], json.dumps(q["options"], ensure_ascii=False),
+             q["correct"], q["explanation"], normalize_question(q["question"]), now)
+            for q in questions
+        ]
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO questions (doc_hash, language, difficulty, question, options, correct, "
+                "explanation, dedupe_key, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            return cursor.rowcount
+
+    def counts(self, doc_hash, language):
+        """Banked questions per difficulty for a document"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT difficulty, COUNT(*) FROM questions WHERE doc_hash = ? AND language = ? GROUP BY difficulty",
+                (doc_hash, language)
+            ).fetchall()
+        counts = dict.fromkeys(DIFFICULTIES, 0)
+        counts.update({difficulty: count for difficulty, count in rows})
+        return counts
+
+    def draw(self, doc_hash, language, num_easy, num_mid, num_hard, exclude=()):
+        """A random quiz with exactly the requested mix, or None if the bank is short of any difficulty.
+
+        Questions whose text matches one in exclude are never drawn.
+        """
+        wanted = {"easy": num_easy, "mid": num_mid, "hard": num_hard}
+        excluded = sorted({normalize_question(question) for question in exclude})
+        not_in = f" AND dedupe_key NOT IN ({', '.join('?' * len(excluded))})" if excluded else ""
+        picked = []
+        with self._lock:
+            for difficulty, count in wanted.items():
+                if count <= 0:
+                    continue
+                rows = self._conn.execute(
+                    f"SELECT {COLUMNS} FROM questions q WHERE doc_hash = ? AND language = ? AND difficulty = ?"
+                    f"{not_in} ORDER BY random() LIMIT ?",
+                    (doc_hash, language, difficulty, *excluded, count)
+                ).fetchall()
+                if len(rows) < count:
+                    return None
+                picked.extend(rows)
+        # Insertion order roughly follows the document, like a freshly generated quiz
+        picked.sort(key=lambda row: row["id"])
+        return [_row_to_question(row) for row in picked]
+
+    def search(self, query, language=None, limit=20):
+        """Questions whose question or explanation text matches query, best matches first"""
+        with self._lock:
+            if self.full_text:
+                # Quote each term so user input cannot be read as FTS query syntax
+                match = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+                if not match:
+                    return []
+                sql = (f"SELECT {COLUMNS} FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid "
+                       "WHERE questions_fts MATCH ?")
+                params = [match]
+                order = " ORDER BY bm25(questions_fts)"
+            else:
+                sql = f"SELECT {COLUMNS} FROM questions q WHERE (q.question LIKE ? OR q.explanation LIKE ?)"
+                params = [f"%{query}%", f"%{query}%"]
+                order = " ORDER BY q.id"
+            if language is not None:
+                sql += " AND q.language = ?"
+                params.append(language)
+            rows = self._conn.execute(sql + order + " LIMIT ?", params + [limit]).fetchall()
+        return [dict(_row_to_question(row), doc_hash=row["doc_hash"]) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            questions, documents = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT doc_hash || language) FROM questions"
+            ).fetchone()
+        return {"questions": questions, "documents": documents, "full_text": self.full_text}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _row_to_question(row):
+    return {
+        "question": row["question"],
+        "options": json.loads(row["options"]),
+        "correct": row["correct"],
+        "difficulty": row["difficulty"],
+        "explanation": row["explanation"],
+    }
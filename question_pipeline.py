@@ -0,0 +1,547 @@
+import json
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json_parsing import IncrementalObjectParser, recover_objects, repair_stats
+from metrics import metrics
+from rate_limiter import CHARS_PER_TOKEN
+
+CHUNK_SIZE = 3000  # Minimum characters of context sent with each generation call
+MAX_CHUNKS = 8  # Upper bound on parallel calls per generation
+QUESTIONS_PER_CALL = 4  # Questions asked for in each call, so a 10-question quiz takes 3 calls rather than 8
+TOKEN_BUDGET = 6000  # Tokens of document context sent across all calls of one generation
+
+DIFFICULTIES = ("easy", "mid", "hard")
+AVOID_LIMIT = 20  # Earlier questions listed in a prompt so the model does not repeat them
+TOP_UP_ROUNDS = 2  # Extra rounds of calls for difficulties still short after the first round
+REQUIRED_FIELDS = ("question", "options", "correct", "difficulty", "explanation")
+
+
+def split_counts(total_questions, easy_pct, mid_pct):
+    """Turn a question total and difficulty percentages into easy/mid/hard counts"""
+    num_easy = int(total_questions * (easy_pct / 100))
+    num_mid = int(total_questions * (mid_pct / 100))
+    num_hard = total_questions - num_easy - num_mid
+    return num_easy, num_mid, num_hard
+
+
+def split_into_chunks(text, chunk_size=CHUNK_SIZE):
+    """Split text into chunks of at most chunk_size characters, preferring paragraph and sentence breaks"""
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            # Back off to the nearest natural break in the second half of the window
+            window = text[start:end]
+            for sep in ("\n\n", "\n", ". ", "؟ ", "? ", " "):
+                cut = window.rfind(sep)
+                if cut > chunk_size // 2:
+                    end = start + cut + len(sep)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
+
+def select_chunks(chunks, limit):
+    """Pick up to limit chunks spread evenly across the document"""
+    if len(chunks) <= limit:
+        return list(chunks)
+    step = len(chunks) / limit
+    return [chunks[int(i * step)] for i in range(limit)]
+
+
+def select_context(text, num_chunks, chunk_size=CHUNK_SIZE, token_budget=TOKEN_BUDGET):
+    """Pick the most informative passages that fit the token budget, grouped into at most num_chunks chunks.
+
+    Documents that already fit are chunked as they are; longer ones go through the
+    passage index so the context comes from the substance of the document rather
+    than its title page or table of contents.
+    """
+    char_budget = min(num_chunks * chunk_size, token_budget * CHARS_PER_TOKEN)
+    if len(text) <= char_budget:
+        return select_chunks(split_into_chunks(text, chunk_size), num_chunks)
+    from passage_index import get_passage_index  # Pulls in numpy; short documents never need it
+    passages = get_passage_index(text).select(char_budget)
+    if not passages:
+        return []
+    # Group consecutive passages so each chunk gets a similar share of the selection
+    total = sum(len(p) for p in passages)
+    groups = [[] for _ in range(min(num_chunks, len(passages)))]
+    offset = 0
+    for passage in passages:
+        groups[offset * len(groups) // total].append(passage)
+        offset += len(passage)
+    return ["\n\n".join(group) for group in groups if group]
+
+
+def plan_chunks(total_questions, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS, token_budget=TOKEN_BUDGET):
+    """Number of calls and characters of context per call for a generation of total_questions.
+
+    Each call asks for about QUESTIONS_PER_CALL questions, and the calls share
+    the token budget, so fewer calls each get a larger slice of the document.
+    """
+    num_chunks = max(1, min(max_chunks, math.ceil(total_questions / QUESTIONS_PER_CALL)))
+    return num_chunks, max(chunk_size, token_budget * CHARS_PER_TOKEN // num_chunks)
+
+
+def allocate_counts(num_easy, num_mid, num_hard, num_chunks):
+    """Spread the requested difficulty counts across chunks as evenly as possible"""
+    labels = ["easy"] * num_easy + ["mid"] * num_mid + ["hard"] * num_hard
+    allocation = [{"easy": 0, "mid": 0, "hard": 0} for _ in range(num_chunks)]
+    for i, label in enumerate(labels):
+        allocation[i % num_chunks][label] += 1
+    return allocation
+
+
+def normalize_question(question_text):
+    """Question text lowercased with punctuation collapsed, so rewordings of spacing or case compare equal"""
+    return re.sub(r"\W+", " ", str(question_text).lower()).strip()
+
+
+def dedupe_questions(questions):
+    """Drop questions whose normalized text was already seen"""
+    seen = set()
+    unique = []
+    for q in questions:
+        key = normalize_question(q.get("question", ""))
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(q)
+    return unique
+
+
+def rebalance_questions(questions, num_easy, num_mid, num_hard):
+    """Pick questions to match the requested mix, topping up shortfalls from other difficulties"""
+    targets = {"easy": num_easy, "mid": num_mid, "hard": num_hard}
+    picked = set()
+    for i, q in enumerate(questions):
+        difficulty = q.get("difficulty")
+        if targets.get(difficulty, 0) > 0:
+            targets[difficulty] -= 1
+            picked.add(i)
+    shortfall = sum(targets.values())
+    for i in range(len(questions)):
+        if shortfall <= 0:
+            break
+        if i not in picked:
+            picked.add(i)
+            shortfall -= 1
+    # Keep document order so questions follow the flow of the text
+    return [q for i, q in enumerate(questions) if i in picked]
+
+
+def generate_chunked(text, num_easy, num_mid, num_hard, generate_chunk, chunk_size=CHUNK_SIZE,
+                     max_chunks=MAX_CHUNKS, max_workers=None, token_budget=TOKEN_BUDGET,
+                     split_difficulty=False):
+    """Map generate_chunk over document chunks in parallel, then merge, dedupe and rebalance.
+
+    All calls run at once unless max_workers caps them, so the generation takes
+    about as long as its slowest call.
+
+    generate_chunk(chunk_text, num_easy, num_mid, num_hard) must return a list of
+    validated question dicts and must not touch Streamlit (it runs in worker threads).
+    With split_difficulty, each difficulty it needs gets a single call with its
+    own slice of the context, so at most three calls run and each asks for one level.
+    Returns (questions, errors) where errors holds exceptions from failed chunks.
+    """
+    total = num_easy + num_mid + num_hard
+    if total <= 0:
+        return [], []
+    requested = dict(zip(DIFFICULTIES, (num_easy, num_mid, num_hard)))
+    needed = [d for d in DIFFICULTIES if requested[d] > 0]
+    if split_difficulty:
+        num_chunks = len(needed)
+        chunk_size = max(chunk_size, token_budget * CHARS_PER_TOKEN // num_chunks)
+    else:
+        num_chunks, chunk_size = plan_chunks(total, chunk_size, max_chunks, token_budget)
+    chunks = select_context(text, num_chunks, chunk_size, token_budget)
+    if not chunks:
+        return [], []
+    if split_difficulty:
+        # A short document can give fewer chunks than difficulties; they then share one
+        jobs = [
+            (chunks[i % len(chunks)], {d: requested[d] if d == difficulty else 0 for d in DIFFICULTIES})
+            for i, difficulty in enumerate(needed)
+        ]
+    else:
+        allocation = allocate_counts(num_easy, num_mid, num_hard, len(chunks))
+        jobs = [(chunk, counts) for chunk, counts in zip(chunks, allocation) if sum(counts.values())]
+
+    results = [None] * len(jobs)
+    errors = []
+    with ThreadPoolExecutor(max_workers=min(max_workers or len(jobs), len(jobs))) as executor:
+        futures = [
+            executor.submit(generate_chunk, chunk, counts["easy"], counts["mid"], counts["hard"])
+            for chunk, counts in jobs
+        ]
+        for i, future in enumerate(futures):
+            try:
+                results[i] = future.result() or []
+            except Exception as e:
+                errors.append(e)
+                results[i] = []
+
+    merged = [q for chunk_questions in results for q in chunk_questions]
+    merged = dedupe_questions(merged)
+    return rebalance_questions(merged, num_easy, num_mid, num_hard), errors
+
+
+def validate_question(question):
+    """Validate the structure of a question and fix common issues"""
+    if not isinstance(question, dict):
+        return None
+        
+    if not all(key in question for key in REQUIRED_FIELDS):
+        return None
+    
+    # Ensure we have at least 2 options
+    if not isinstance(question['options'], list) or len(question['options']) < 2:
+        return None
+    
+    # Ensure correct answer is one of the options
+    if question['correct'] not in ['A', 'B', 'C', 'D']:
+        # Try to find the correct answer in options
+        for i, option in enumerate(question['options']):
+            if option == question['correct']:
+                question['correct'] = chr(65 + i)  # Convert to A, B, C, D
+                break
+        else:
+            # If we can't match, default to first option
+            question['correct'] = 'A'
+    
+    return question
+
+
+def _avoid_requirement(avoid, language):
+    if not avoid:
+        return ""
+    listed = "\n".join(f"  * {question[:200]}" for question in list(avoid)[-AVOID_LIMIT:])
+    if language == "ar":
+        return f"- لا تكرر هذه الأسئلة ولا تعِد صياغتها:\n{listed}\n"
+    return f"- Do not repeat or rephrase these questions:\n{listed}\n"
+
+
+def build_prompt(text, num_easy, num_mid, num_hard, language="en", avoid=()):
+    """Build the generation prompt for one chunk of text; avoid lists questions already asked"""
+    total_questions = num_easy + num_mid + num_hard
+    avoid_requirement = _avoid_requirement(avoid, language)
+    if language == "ar":
+        return f"""قم بإنشاء {total_questions} أسئلة اختيار من متعدد بصيغة JSON من النص التالي:
+{text}
+كل سؤال يجب أن يكون بهذا الشكل:
+{{
+    "question": "...",
+    "options": ["خيار 1", "خيار 2", "خيار 3", "خيار 4"],
+    "correct": "A",
+    "difficulty": "easy|mid|hard",
+    "explanation": "..."
+}}
+المتطلبات:
+- {num_easy} أسئلة سهلة (استرجاع بسيط)
+- {num_mid} أسئلة متوسطة (تطبيق)
+- {num_hard} أسئلة صعبة (تحليل)
+- تأكد أن الإجابة الصحيحة هي 'A' أو 'B' أو 'C' أو 'D'
+{avoid_requirement}- لا تُرجع سوى المصفوفة JSON، ولا شيء آخر"""
+    return f"""Generate {total_questions} multiple choice questions as a JSON array from this text:
+{text}
+Format each question like this:
+{{
+    "question": "...",
+    "options": ["Option 1", "Option 2", "Option 3", "Option 4"],
+    "correct": "A",
+    "difficulty": "easy|mid|hard",
+    "explanation": "..."
+}}
+Requirements:
+- {num_easy} easy questions (basic recall)
+- {num_mid} medium questions (application)
+- {num_hard} hard questions (analysis)
+- Ensure correct answer is ONLY 'A', 'B', 'C', or 'D'
+{avoid_requirement}- Only return the JSON array, nothing else"""
+
+
+def parse_questions(raw_text):
+    """Parse a model response into validated questions, salvaging what it can from malformed output.
+
+    Returns (questions, skipped_count). Raises json.JSONDecodeError only when
+    nothing at all could be recovered.
+    """
+    with metrics.timer("parse_seconds"):
+        objects, strict, repaired, dropped = recover_objects(raw_text, REQUIRED_FIELDS)
+    repair_stats.record(strict, bool(objects), repaired, dropped)
+    if not objects and not strict:
+        raise json.JSONDecodeError("No question objects found in response", raw_text, 0)
+    validated_questions = []
+    skipped = 0
+    with metrics.timer("validate_seconds"):
+        for q in objects:
+            validated = validate_question(q)
+            if validated:
+                validated_questions.append(validated)
+            else:
+                skipped += 1
+    metrics.increment("questions_validated", len(validated_questions))
+    metrics.increment("questions_rejected", skipped)
+    return validated_questions, skipped
+
+
+def missing_counts(questions, num_easy, num_mid, num_hard):
+    """Per-difficulty counts still needed, capped at the overall shortfall"""
+    remaining = {"easy": num_easy, "mid": num_mid, "hard": num_hard}
+    for q in questions:
+        if remaining.get(q.get("difficulty"), 0) > 0:
+            remaining[q["difficulty"]] -= 1
+    shortfall = max(0, num_easy + num_mid + num_hard - len(questions))
+    missing = []
+    for difficulty in DIFFICULTIES:
+        take = min(remaining[difficulty], shortfall)
+        missing.append(take)
+        shortfall -= take
+    return tuple(missing)
+
+
+def generate_validated(text, num_easy, num_mid, num_hard, generate_text, language="en",
+                       follow_up=True, avoid=(), **kwargs):
+    """Run the chunked pipeline with generate_text(prompt) -> raw response text.
+
+    When a chunk comes back short (malformed output or rejected questions), one
+    small follow-up call asks for just the missing questions. Questions matching
+    one in avoid (question texts already asked) are dropped. Returns
+    (questions, errors, skipped_count).
+    """
+    skipped = []
+    avoid_keys = {normalize_question(question) for question in avoid}
+
+    def parse_new(raw_text):
+        questions, chunk_skipped = parse_questions(raw_text)
+        return [q for q in questions if normalize_question(q["question"]) not in avoid_keys], chunk_skipped
+
+    def call_model(chunk, chunk_easy, chunk_mid, chunk_hard):
+        with metrics.timer("prompt_build_seconds"):
+            prompt = build_prompt(chunk, chunk_easy, chunk_mid, chunk_hard, language, avoid)
+        metrics.observe("prompt_chars", len(prompt))
+        with metrics.timer("model_call_seconds", mode="batch"):
+            raw_text = generate_text(prompt)
+        metrics.observe("response_chars", len(raw_text))
+        return raw_text
+
+    def generate_chunk(chunk, chunk_easy, chunk_mid, chunk_hard):
+        raw_text = call_model(chunk, chunk_easy, chunk_mid, chunk_hard)
+        questions, chunk_skipped = parse_new(raw_text)
+        skipped.append(chunk_skipped)
+        missing = missing_counts(questions, chunk_easy, chunk_mid, chunk_hard)
+        if follow_up and questions and sum(missing):
+            repair_stats.record_follow_up()
+            try:
+                extra, extra_skipped = parse_new(call_model(chunk, *missing))
+            except json.JSONDecodeError:
+                return questions
+            skipped.append(extra_skipped)
+            questions += extra
+        return questions
+
+    questions, errors = generate_chunked(text, num_easy, num_mid, num_hard, generate_chunk, **kwargs)
+    return questions, errors, sum(skipped)
+
+
+def generate_balanced(text, num_easy, num_mid, num_hard, generate_text, language="en", avoid=(),
+                      top_up_rounds=TOP_UP_ROUNDS, **kwargs):
+    """Per-difficulty generation: parallel single-level calls, then top-ups for whatever validation rejected.
+
+    The first round sends each difficulty its own call. Each later round asks
+    only for the shortfall in each difficulty, avoiding questions already
+    accepted, until every level is full, a round adds nothing, or top_up_rounds
+    runs out. Returns (questions, errors, skipped_count, report), where report
+    compares requested and delivered counts per difficulty.
+    """
+    start = time.perf_counter()
+    requested = dict(zip(DIFFICULTIES, (num_easy, num_mid, num_hard)))
+    calls = [0, 0]  # First round, top-ups
+    lock = threading.Lock()
+    collected = []
+    errors = []
+    skipped = 0
+
+    for round_number in range(1 + top_up_rounds):
+        delivered = {d: sum(q.get("difficulty") == d for q in collected) for d in DIFFICULTIES}
+        wanted = [max(0, requested[d] - delivered[d]) for d in DIFFICULTIES]
+        if not sum(wanted):
+            break
+
+        def counted(prompt, slot=min(round_number, 1)):
+            with lock:
+                calls[slot] += 1
+            return generate_text(prompt)
+
+        asked = list(avoid) + [q["question"] for q in collected]
+        questions, round_errors, round_skipped = generate_validated(
+            text, *wanted, counted, language=language, follow_up=False, avoid=asked,
+            split_difficulty=True, **kwargs
+        )
+        errors.extend(round_errors)
+        skipped += round_skipped
+        before = len(collected)
+        collected = dedupe_questions(collected + questions)
+        if len(collected) == before:
+            break
+
+    questions = rebalance_questions(collected, num_easy, num_mid, num_hard)
+    report = {
+        "requested": requested,
+        "delivered": {d: sum(q.get("difficulty") == d for q in questions) for d in DIFFICULTIES},
+        "calls": calls[0],
+        "top_up_calls": calls[1],
+        "seconds": time.perf_counter() - start,
+    }
+    metrics.increment("top_up_calls", calls[1])
+    return questions, errors, skipped, report
+
+
+class QuestionStream:
+    """Collects questions from background producers so the quiz can start on the first one.
+
+    Questions are deduplicated and capped per difficulty as they arrive; extras are
+    held in reserve and used to fill any shortfall when the producers finish.
+    """
+
+    def __init__(self, num_easy, num_mid, num_hard):
+        self.targets = {"easy": num_easy, "mid": num_mid, "hard": num_hard}
+        self.total = num_easy + num_mid + num_hard
+        self.questions = []
+        self.reserve = []
+        self.errors = []
+        self.skipped = 0
+        self.done = False
+        self.cancelled = False
+        self._seen = set()
+        self._cond = threading.Condition()
+        self._started = time.perf_counter()
+        self._watchers = 1
+
+    def add(self, question):
+        """Offer a validated question; returns True if it joined the quiz"""
+        key = normalize_question(question.get("question", ""))
+        with self._cond:
+            if self.done or self.cancelled or not key or key in self._seen:
+                return False
+            self._seen.add(key)
+            difficulty = question.get("difficulty")
+            if self.targets.get(difficulty, 0) > 0 and len(self.questions) < self.total:
+                self.targets[difficulty] -= 1
+                self.questions.append(question)
+                if len(self.questions) == 1:
+                    metrics.observe("first_question_seconds", time.perf_counter() - self._started, mode="stream")
+                self._cond.notify_all()
+                return True
+            self.reserve.append(question)
+            return False
+
+    def finish(self, errors=()):
+        """Mark the stream complete, topping up from the reserve; unused extras stay in reserve"""
+        with self._cond:
+            self.errors.extend(errors)
+            shortfall = max(self.total - len(self.questions), 0)
+            self.questions.extend(self.reserve[:shortfall])
+            self.reserve = self.reserve[shortfall:]
+            self.done = True
+            self._cond.notify_all()
+
+    def attach(self):
+        """Share a running stream with one more quiz; returns False once it has finished or been cancelled"""
+        with self._cond:
+            if self.done or self.cancelled:
+                return False
+            self._watchers += 1
+            return True
+
+    def cancel(self):
+        """Stop generating once every quiz sharing the stream has cancelled it"""
+        with self._cond:
+            self._watchers -= 1
+            if self._watchers > 0:
+                return
+            self.cancelled = True
+            self.done = True
+            self._cond.notify_all()
+
+    def wait_for(self, count, timeout=None):
+        """Block until at least count questions are available or the stream ends"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.questions) >= count or self.done, timeout)
+            return len(self.questions) >= count
+
+    def expected_total(self):
+        return len(self.questions) if self.done else self.total
+
+
+def start_streaming(text, num_easy, num_mid, num_hard, stream_chunk, on_finish=None, **kwargs):
+    """Run generate_chunked in a background thread, feeding a QuestionStream.
+
+    stream_chunk(stream, chunk_text, num_easy, num_mid, num_hard) should add each
+    validated question to the stream as soon as it is parsed. on_finish(stream)
+    runs in the background thread once all chunks are done.
+    """
+    stream = QuestionStream(num_easy, num_mid, num_hard)
+
+    def generate_chunk(chunk, chunk_easy, chunk_mid, chunk_hard):
+        if stream.cancelled:
+            return []
+        stream_chunk(stream, chunk, chunk_easy, chunk_mid, chunk_hard)
+        return []
+
+    def run():
+        try:
+            _, errors = generate_chunked(text, num_easy, num_mid, num_hard, generate_chunk, **kwargs)
+        except Exception as e:
+            errors = [e]
+        stream.finish(errors)
+        if on_finish and not stream.cancelled:
+            on_finish(stream)
+
+    threading.Thread(target=run, daemon=True).start()
+    return stream
+
+
+def stream_validated(text, num_easy, num_mid, num_hard, stream_text, language="en", on_finish=None, **kwargs):
+    """Streaming counterpart of generate_validated; stream_text(prompt) yields response pieces"""
+
+    def stream_chunk(stream, chunk, chunk_easy, chunk_mid, chunk_hard):
+        parser = IncrementalObjectParser(REQUIRED_FIELDS)
+        parsed = 0
+        with metrics.timer("prompt_build_seconds"):
+            prompt = build_prompt(chunk, chunk_easy, chunk_mid, chunk_hard, language)
+        metrics.observe("prompt_chars", len(prompt))
+        start = time.perf_counter()
+        first_piece = True
+        for piece in stream_text(prompt):
+            if first_piece:
+                metrics.observe("model_first_token_seconds", time.perf_counter() - start)
+                first_piece = False
+            if stream.cancelled:
+                return
+            objects = parser.feed(piece)
+            parsed += len(objects)
+            add_validated(stream, objects)
+        metrics.observe("model_call_seconds", time.perf_counter() - start, mode="stream")
+        objects = parser.finish()
+        add_validated(stream, objects)
+        parsed += len(objects)
+        strict = not (parser.repaired or parser.dropped or objects)
+        repair_stats.record(strict, bool(parsed), parser.repaired, parser.dropped)
+
+    def add_validated(stream, objects):
+        for q in objects:
+            validated = validate_question(q)
+            if validated:
+                stream.add(validated)
+            else:
+                stream.skipped += 1
+
+    return start_streaming(text, num_easy, num_mid, num_hard, stream_chunk, on_finish, **kwargs)
@@ -0,0 +1,203 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+
+CHARS_PER_TOKEN = 4  # Rough average for the models we call
+RETRY_AFTER_PATTERNS = (
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+(?:\.\d+)?)"),
+    re.compile(r"retry (?:after|in) (\d+(?:\.\d+)?)\s*s", re.IGNORECASE),
+)
+
+
+class RateLimitError(Exception):
+    """Raised when a call is still rate limited after all retries"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text):
+    """Rough token count from the text length"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def is_rate_limit_error(error):
+    if isinstance(error, RateLimitError):
+        return True
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    return "429" in str(error) or type(error).__name__ in ("ResourceExhausted", "RateLimitError")
+
+
+def retry_after_seconds(error):
+    """Extract a server-provided retry hint from an error, if any"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+    message = str(error)
+    for pattern in RETRY_AFTER_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    """Refills at rate_per_minute up to capacity; amounts are requests or tokens"""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.level = self.capacity
+        self.clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be consumed (0 if available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)  # Oversized requests wait for a full bucket
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Process-wide limiter shared by every session.
+
+    Callers queue per session and are served round-robin across sessions, so one
+    user generating many chunks cannot starve the others. Rate-limit errors back
+    off exponentially with jitter, honour retry-after hints, and pause the whole
+    limiter so other sessions stop hitting the API in the meantime.
+    """
+
+    def __init__(self, requests_per_minute=15, tokens_per_minute=1_000_000, max_retries=4,
+                 base_delay=1.0, max_delay=60.0, clock=time.monotonic):
+        self.requests = TokenBucket(requests_per_minute, clock=clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._queues = {}  # session_id -> deque of waiting tickets
+        self._order = deque()  # Sessions with waiters, in round-robin order
+        self._paused_until = 0.0
+        self._next_ticket = 0
+        # Metrics
+        self.granted = 0
+        self.throttled = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _wait_needed(self, tokens):
+        pause = max(0.0, self._paused_until - self.clock())
+        return max(pause, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def acquire(self, session_id, tokens=1, timeout=None):
+        """Wait for this session's turn and for budget in both buckets"""
+        start = self.clock()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            if session_id not in self._queues:
+                self._queues[session_id] = deque()
+                self._order.append(session_id)
+            self._queues[session_id].append(ticket)
+            try:
+                while True:
+                    is_head = self._order[0] == session_id and self._queues[session_id][0] == ticket
+                    wait = self._wait_needed(tokens) if is_head else None
+                    if wait == 0.0:
+                        break
+                    if timeout is not None:
+                        remaining = timeout - (self.clock() - start)
+                        if remaining <= 0:
+                            raise RateLimitError("Timed out waiting for the rate limiter", retry_after=wait)
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+                self.requests.consume(1)
+                self.tokens.consume(tokens)
+            finally:
+                self._dequeue(session_id, ticket)
+                self._cond.notify_all()
+            waited = self.clock() - start
+            self.granted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            return waited
+
+    def _dequeue(self, session_id, ticket):
+        queue = self._queues[session_id]
+        queue.remove(ticket)
+        was_head = self._order[0] == session_id
+        if not queue:
+            del self._queues[session_id]
+            self._order.remove(session_id)
+        elif was_head:
+            self._order.rotate(-1)  # Give the next session a turn
+
+    def backoff_delay(self, attempt, error=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, fn, session_id, tokens=1, timeout=None):
+        """Run fn() under the limiter, retrying rate-limit errors with backoff.
+
+        timeout bounds the whole call, queueing and retries included: once the
+        next retry could not start within it, RateLimitError is raised instead.
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        for attempt in range(self.max_retries + 1):
+            remaining = None if deadline is None else deadline - self.clock()
+            self.acquire(session_id, tokens, timeout=remaining)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                with self._cond:
+                    self.throttled += 1
+                    if attempt == self.max_retries:
+                        raise RateLimitError(str(e), retry_after=retry_after_seconds(e)) from e
+                    delay = self.backoff_delay(attempt, e)
+                    self._paused_until = max(self._paused_until, self.clock() + delay)
+                    self._cond.notify_all()
+                    # Other sessions still back off, but this caller gives up rather than outwait its timeout
+                    if deadline is not None and self.clock() + delay >= deadline:
+                        raise RateLimitError(str(e), retry_after=delay) from e
+                    self.retries += 1
+
+    def estimated_wait(self, tokens=1):
+        """Rough seconds a new request would wait, for user-facing messages"""
+        with self._cond:
+            queued = sum(len(q) for q in self._queues.values())
+            return self._wait_needed(tokens) + queued / self.requests.rate
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "queue_depth": sum(len(q) for q in self._queues.values()),
+                "waiting_sessions": len(self._order),
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "avg_wait_seconds": self.total_wait / self.granted if self.granted else 0.0,
+                "max_wait_seconds": self.max_wait,
+                "paused_for_seconds": max(0.0, self._paused_until - self.clock()),
+            }
@@ -0,0 +1,106 @@
+import threading
+import time
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised in a waiter whose shared call did not finish within its timeout"""
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.started = time.monotonic()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapses identical concurrent calls into one, sharing its result.
+
+    The first caller for a key runs the call; callers arriving with the same key
+    while it is in flight wait for it and get the same result, or the same
+    exception re-raised. A key is released as soon as its call finishes, so
+    results are not cached here; later callers start a fresh call.
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> _Flight for blocking calls
+        self._live = {}  # key -> shared object started by join()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None):
+        """fn() run once for all concurrent callers with this key.
+
+        A waiter gives up after timeout seconds with SingleFlightTimeout; the stuck
+        flight is then released so the next caller for the key starts a new call
+        instead of queueing behind it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+                with self._lock:
+                    self.errors += 1
+            finally:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                flight.done.set()
+        elif not flight.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            raise SingleFlightTimeout(f"Shared call did not finish within {timeout} seconds")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def join(self, key, start, watch=True):
+        """The live object for key if one can be shared, else start() registered under key.
+
+        For calls that return a handle immediately, such as a QuestionStream: an
+        existing handle is shared when its attach() returns True, meaning it is
+        still running and now has one more watcher. With watch=False the caller
+        only wants the call to happen: a running handle is returned without
+        attaching, so the caller must not cancel it.
+        """
+        with self._lock:
+            live = self._live.get(key)
+            if live is not None and (live.attach() if watch else not live.done):
+                self.coalesced += 1
+                return live
+            self._live.pop(key, None)
+            # Streams for other keys that have finished are dropped here rather than tracked
+            for other in [k for k, v in self._live.items() if v.done]:
+                del self._live[other]
+            live = start()
+            self.calls += 1
+            if live is not None:
+                self._live[key] = live
+            return live
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights) + sum(not live.done for live in self._live.values()),
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+            }
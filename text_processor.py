@@ -1,8 +1,136 @@
+import os
+import tempfile
+import uuid
 import PyPDF2
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 
-def extract_text_from_pdf(pdf_file):
-    pdf_reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
\ No newline at end of file
+PAGES_PER_TASK = 25  # Page range handed to each worker process
+PARALLEL_MIN_PAGES = 100  # Below this, process start-up costs more than it saves
+
+
+def _pdf_bytes(pdf_file):
+    """Return the raw bytes of a path or file-like object without disturbing its position"""
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    if isinstance(pdf_file, str):
+        with open(pdf_file, "rb") as f:
+            return f.read()
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    position = pdf_file.tell()
+    pdf_file.seek(0)
+    data = pdf_file.read()
+    pdf_file.seek(position)
+    return data
+
+
+def _open_reader(pdf_file):
+    if isinstance(pdf_file, (bytes, bytearray)):
+        pdf_file = BytesIO(pdf_file)
+    return PyPDF2.PdfReader(pdf_file)
+
+
+_worker_reader = (None, None)  # (document id, reader) last parsed in this worker process
+
+
+def _extract_range(args):
+    """Worker entry point: extract the text of pages [start, stop) from the PDF at path.
+
+    Tasks carry only the path; each worker parses the file once and reuses the
+    reader for every further range of the same extraction it is given.
+    """
+    global _worker_reader
+    path, document_id, start, stop = args
+    if _worker_reader[0] != document_id:
+        _worker_reader = (document_id, _open_reader(path))
+    reader = _worker_reader[1]
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def iter_pdf_pages(pdf_file, start=0, stop=None):
+    """Yield the text of each page, one at a time"""
+    pages = _open_reader(pdf_file).pages
+    stop = len(pages) if stop is None else min(stop, len(pages))
+    for i in range(start, stop):
+        yield pages[i].extract_text() or ""
+
+
+def iter_pdf_pages_parallel(pdf_file, workers=4, pages_per_task=PAGES_PER_TASK, total_pages=None, executor=None):
+    """Yield page text in order while worker processes extract page ranges ahead of the consumer.
+
+    With executor, ranges go to that shared pool, which is left running; otherwise
+    a pool of workers processes is started for this document and shut down after.
+    """
+    if isinstance(pdf_file, str):
+        path, temporary = pdf_file, False
+    else:
+        # Workers read the document from a file rather than having it pickled into every task
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(_pdf_bytes(pdf_file))
+        path, temporary = f.name, True
+    if total_pages is None:
+        total_pages = len(_open_reader(path).pages)
+    document_id = uuid.uuid4().hex
+    ranges = [
+        (path, document_id, start, min(start + pages_per_task, total_pages))
+        for start in range(0, total_pages, pages_per_task)
+    ]
+    owned = executor is None
+    if owned:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    futures = [executor.submit(_extract_range, task) for task in ranges]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        # Lets callers stop early without waiting for the remaining ranges
+        for future in futures:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if temporary:
+            # PdfReader reads the whole file into memory, so ranges still running no longer need it
+            os.remove(path)
+
+
+def extract_text_from_pdf(pdf_file, separator="", max_chars=None, workers=None, progress=None,
+                          normalizer=None, cleaner=None, executor=None):
+    """Extract the text of a PDF, joining pages once at the end.
+
+    Stops reading pages once max_chars characters are available. When workers > 1
+    or a shared executor is given and the document is long enough, pages are
+    extracted in a process pool.
+    progress(done_pages, total_pages) is called after each page. A streaming
+    normalizer (an object with feed/finish, e.g. ArabicNormalizer) is applied
+    to the pages inline as they arrive. A cleaner (e.g. LayoutCleaner) strips
+    headers, footers and layout noise from the pages before that.
+    """
+    reader = _open_reader(pdf_file)
+    total_pages = len(reader.pages)
+    parallel = executor is not None or (workers and workers > 1)
+    if parallel and total_pages >= PARALLEL_MIN_PAGES:
+        pages = iter_pdf_pages_parallel(pdf_file, workers=workers, total_pages=total_pages, executor=executor)
+    else:
+        pages = (page.extract_text() or "" for page in reader.pages)
+    source = pages
+    if cleaner is not None:
+        pages = cleaner.clean_pages(source)
+
+    join_with = "" if normalizer is not None else separator
+    parts = []
+    length = 0
+    for i, page_text in enumerate(pages):
+        if normalizer is not None:
+            page_text = normalizer.feed(separator + page_text if i else page_text)
+        parts.append(page_text)
+        length += len(page_text) + len(join_with)
+        if progress:
+            progress(min(i + 1, total_pages), total_pages)
+        if max_chars is not None and length >= max_chars:
+            source.close()
+            break
+    if normalizer is not None:
+        parts.append(normalizer.finish())
+    text = join_with.join(parts)
+    return text[:max_chars] if max_chars is not None else text